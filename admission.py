@@ -0,0 +1,111 @@
+"""
+Admission control for /api/messages: request size, per-conversation rate and global
+concurrency limits, so that a few abusive chats cannot starve everyone else.
+"""
+from collections import OrderedDict
+from time import monotonic
+
+from aiohttp import web
+
+
+class TokenBucketLimiter:
+    """
+    One token bucket per key (e.g. conversation id). Each bucket holds up to burst
+    tokens and refills at rate tokens per second; a request takes one token.
+    At most max_keys buckets are kept; past that, the least recently used go first.
+    """
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # key: key, value: [tokens, time of last update]. least recently used first.
+        self.buckets = OrderedDict()
+
+    def allow(self, key):
+        """
+        :return: True if the request may go ahead.
+        """
+        now = monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self._prune(now)
+            bucket = self.buckets[key] = [self.burst, now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self.buckets.move_to_end(key)
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def retry_after(self, key):
+        """
+        :return: seconds until key has a token again.
+        """
+        bucket = self.buckets.get(key)
+        if bucket is None or bucket[0] >= 1 or not self.rate:
+            return 0
+        return (1 - bucket[0]) / self.rate
+
+    def _prune(self, now):
+        # buckets that have refilled completely are the same as new ones. they are
+        # looked for among the least recently used only, so that a flood of new keys
+        # does not rescan every bucket. if none has refilled, the oldest is dropped.
+        freed = False
+        while self.buckets:
+            key, (tokens, last) = next(iter(self.buckets.items()))
+            if tokens + (now - last) * self.rate < self.burst:
+                break
+            del self.buckets[key]
+            freed = True
+        if not freed and self.buckets:
+            self.buckets.popitem(last=False)
+
+
+class ConcurrencyLimiter:
+    """
+    Non-blocking semaphore: requests over the limit are turned away instead of queued.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+
+    def try_acquire(self):
+        if self.active >= self.limit:
+            return False
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+
+
+def too_many_requests(retry_after=1):
+    return web.Response(status=429, text="Too many requests, please try again later.",
+                        headers={"Retry-After": str(max(1, round(retry_after)))})
+
+
+def admission_middleware(max_payload_bytes, concurrency):
+    """
+    :param max_payload_bytes: requests with a larger body get 413.
+    :param concurrency: ConcurrencyLimiter. requests over its limit get 429.
+    :return: aiohttp middleware for the handlers named 'messages'.
+    """
+    @web.middleware
+    async def middleware(req, handler):
+        if getattr(handler, "__name__", None) != "messages":
+            return await handler(req)
+        if req.content_length is not None and req.content_length > max_payload_bytes:
+            return web.Response(status=413)
+        if not concurrency.try_acquire():
+            return too_many_requests()
+        try:
+            return await handler(req)
+        finally:
+            concurrency.release()
+
+    return middleware
@@ -1,25 +1,41 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
+import logging
 import sys
 import traceback
 from datetime import datetime
+from time import perf_counter
 
 from aiohttp import web
 from aiohttp.web import Request, Response, json_response
 from botbuilder.core import (
     BotFrameworkAdapterSettings,
+    ConversationState,
     TurnContext,
     BotFrameworkAdapter,
 )
 from botbuilder.core.integration import aiohttp_error_middleware
 from botbuilder.schema import Activity, ActivityTypes
 
+import metrics
+import tracing
+from admission import (
+    ConcurrencyLimiter,
+    TokenBucketLimiter,
+    admission_middleware,
+    too_many_requests,
+)
 from bot import MyBot
 from config import DefaultConfig
+from storage import SqliteStorage, create_storage
 
 CONFIG = DefaultConfig()
 
+if CONFIG.TRACE:
+    logging.basicConfig()
+    tracing.LOGGER.setLevel(logging.DEBUG)
+
 # Create adapter.
 # See https://aka.ms/about-bot-adapter to learn more about how bots work.
 SETTINGS = BotFrameworkAdapterSettings(CONFIG.APP_ID, CONFIG.APP_PASSWORD)
@@ -33,6 +49,7 @@ async def on_error(context: TurnContext, error: Exception):
     #       application insights.
     print(f"\n [on_turn_error] unhandled error: {error}", file=sys.stderr)
     traceback.print_exc()
+    metrics.ERRORS.inc(type(error).__name__)
 
     # Send a message to the user
     await context.send_activity("The bot encountered an error or bug.")
@@ -56,8 +73,16 @@ async def on_error(context: TurnContext, error: Exception):
 
 ADAPTER.on_turn_error = on_error
 
+# Conversation state holds each conversation's ScheduleBoard and last reply.
+STORAGE = create_storage(CONFIG)
+CONVERSATION_STATE = ConversationState(STORAGE)
+
 # Create the Bot
-BOT = MyBot()
+BOT = MyBot(CONFIG, CONVERSATION_STATE)
+
+
+RATE_LIMITER = TokenBucketLimiter(CONFIG.RATE_LIMIT_PER_MINUTE / 60, CONFIG.RATE_LIMIT_BURST)
+CONCURRENCY = ConcurrencyLimiter(CONFIG.MAX_CONCURRENT_MESSAGES)
 
 
 # Listen for incoming requests on /api/messages
@@ -69,6 +94,9 @@ async def messages(req: Request) -> Response:
         return Response(status=415)
 
     activity = Activity().deserialize(body)
+    conversation_id = activity.conversation.id if activity.conversation else ""
+    if not RATE_LIMITER.allow(conversation_id):
+        return too_many_requests(RATE_LIMITER.retry_after(conversation_id))
     auth_header = req.headers["Authorization"] if "Authorization" in req.headers else ""
 
     try:
@@ -80,11 +108,66 @@ async def messages(req: Request) -> Response:
         raise exception
 
 
-APP = web.Application(middlewares=[aiohttp_error_middleware])
+# Prometheus scrape target.
+async def metrics_handler(req: Request) -> Response:
+    return Response(text=metrics.REGISTRY.render(),
+                    content_type="text/plain", charset="utf-8")
+
+
+async def healthz(req: Request) -> Response:
+    return json_response(data={"status": "ok", "pending_jobs": BOT.pool.pending})
+
+
+@web.middleware
+async def metrics_middleware(req: Request, handler):
+    # Counts and times requests to the bot, i.e. not /metrics and /healthz themselves.
+    name = getattr(handler, "__name__", "other")
+    if name != "messages":
+        return await handler(req)
+    metrics.IN_FLIGHT.inc(name)
+    start = perf_counter()
+    status = 500
+    try:
+        response = await handler(req)
+        status = response.status
+        return response
+    except web.HTTPException as exception:
+        status = exception.status
+        raise
+    except Exception as exception:
+        metrics.ERRORS.inc(type(exception).__name__)
+        raise
+    finally:
+        metrics.IN_FLIGHT.dec(name)
+        metrics.REQUEST_LATENCY.observe(perf_counter() - start, name)
+        metrics.REQUESTS.inc(name, status)
+
+
+async def on_startup(app: web.Application):
+    await BOT.pool.warm_up()
+
+
+async def on_cleanup(app: web.Application):
+    BOT.pool.shutdown()
+    if isinstance(STORAGE, SqliteStorage):
+        await STORAGE.close()
+
+
+MIDDLEWARES = [metrics_middleware] if CONFIG.METRICS else []
+MIDDLEWARES += [
+    admission_middleware(CONFIG.MAX_PAYLOAD_BYTES, CONCURRENCY),
+    aiohttp_error_middleware,
+]
+APP = web.Application(middlewares=MIDDLEWARES, client_max_size=CONFIG.MAX_PAYLOAD_BYTES)
 APP.router.add_post("/api/messages", messages)
+APP.router.add_get("/metrics", metrics_handler)
+APP.router.add_get("/healthz", healthz)
+APP.on_startup.append(on_startup)
+APP.on_cleanup.append(on_cleanup)
 
 if __name__ == "__main__":
     try:
-        web.run_app(APP, host="localhost", port=CONFIG.PORT)
+        web.run_app(APP, host="localhost", port=CONFIG.PORT,
+                    shutdown_timeout=CONFIG.SHUTDOWN_TIMEOUT)
     except Exception as error:
         raise error
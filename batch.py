@@ -0,0 +1,110 @@
+"""
+Solves many schedules offline, in parallel.
+
+Reads JSONL where each line is {"id": ..., "text": "<schedule>"} (or just a JSON string),
+runs the same parse and overlap stages as the bot over a multiprocessing pool, and
+writes one JSONL result per input line, in input order:
+
+    {"id": ..., "key": ..., "intervals": 12, "overlaps": [{"begin": ..., "end": ...,
+     "people": [...]}, ...]}
+
+or {"id": ..., "error": "..."} if the schedule could not be parsed.
+
+    python batch.py schedules.jsonl --output results.jsonl
+    cat schedules.jsonl | python batch.py -
+"""
+import argparse
+import json
+import os
+import sys
+from multiprocessing import Pool
+from time import perf_counter
+
+import overlap_finder as of
+
+
+def solve_record(record, engine=of.DEFAULT_ENGINE, min_people=2):
+    """
+    :param record: dict with 'text' and optionally 'id', or a schedule string.
+    :param engine: see overlap_finder.find_all_common_intervals().
+    :param min_people: quorum, see overlap_finder.find_all_common_intervals().
+    :return: result dict, see module docstring.
+    """
+    if not isinstance(record, dict):
+        record = {'text': record}
+    result = {'id': record.get('id')}
+    try:
+        dt_list, key, _ = of.compute_intervals(record['text'], engine)
+        overlap_dict, _ = of.solve_intervals(dt_list, engine, min_people=min_people)
+    except Exception as e:
+        result['error'] = str(e)
+        return result
+    result['key'] = key
+    result['intervals'] = len(dt_list)
+    result['overlaps'] = [{'begin': interval.begin.isoformat(),
+                           'end': interval.end.isoformat(),
+                           'people': sorted(ids)}
+                          for interval, ids in sorted(overlap_dict.items(),
+                                                      key=lambda item: item[0].begin)]
+    return result
+
+
+def _solve_line(args):
+    line, engine, min_people = args
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        return json.dumps({'id': None, 'error': f"invalid JSON: {e}"})
+    return json.dumps(solve_record(record, engine, min_people))
+
+
+def run_batch(lines, out, processes=None, engine=of.DEFAULT_ENGINE, chunksize=16,
+              min_people=2):
+    """
+    Solves every non-empty line of lines and writes the results to out.
+    :param lines: iterable of JSONL lines.
+    :param out: text file.
+    :param processes: pool size, defaults to the number of CPUs.
+    :param min_people: quorum, see overlap_finder.find_all_common_intervals().
+    :return: (number of messages, seconds taken).
+    """
+    start = perf_counter()
+    count = 0
+    jobs = ((line, engine, min_people) for line in lines if line.strip())
+    with Pool(processes) as pool:
+        for result in pool.imap(_solve_line, jobs, chunksize):
+            out.write(result + "\n")
+            count += 1
+    return count, perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help="JSONL file, or '-' for stdin")
+    parser.add_argument('--output', help="JSONL file to write, defaults to stdout")
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--engine', default=of.DEFAULT_ENGINE,
+                        choices=[of.SWEEP_ENGINE, of.LEGACY_ENGINE])
+    parser.add_argument('--chunksize', type=int, default=16,
+                        help="messages handed to a worker at a time")
+    parser.add_argument('--min-people', type=int, default=2,
+                        help="only report common intervals shared by this many people")
+    args = parser.parse_args()
+
+    lines = sys.stdin if args.input == '-' else open(args.input)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        count, secs = run_batch(lines, out, args.processes, args.engine, args.chunksize,
+                                args.min_people)
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+        if out is not sys.stdout:
+            out.close()
+    rate = count / secs if secs else 0.0
+    print(f"{count} messages in {secs:.2f}s ({rate:.1f} messages/s)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
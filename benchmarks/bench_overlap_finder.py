@@ -0,0 +1,104 @@
+"""
+Benchmarks parse_dt_string, find_all_common_intervals and format_overlaps on synthetic
+schedules, and reports per-stage timings, peak memory and result counts as JSON.
+
+    python -m benchmarks.bench_overlap_finder --people 5 50 500 --output bench.json
+"""
+import argparse
+import itertools
+import json
+import platform
+import statistics
+import sys
+import tracemalloc
+from datetime import datetime as dt
+from time import perf_counter
+
+import overlap_finder as of
+from benchmarks.generate_schedules import DEFAULT_MIX, generate_schedule, parse_mix
+
+
+def measure(func, *args, repeat=3):
+    """
+    :return: (return value of the last run, list of seconds per run, peak bytes allocated
+    during a separate traced run).
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = func(*args)
+        times.append(perf_counter() - start)
+    # traced separately, tracemalloc slows down the run it watches.
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, times, peak
+
+
+def stage_report(times, peak):
+    return {'min_s': min(times), 'median_s': statistics.median(times), 'peak_bytes': peak}
+
+
+def bench_case(people, slots, days, mix, engines, repeat, seed, legacy_max_people):
+    text = generate_schedule(people, slots, days, mix, seed)
+    case = {'people': people, 'slots_per_person': slots, 'days': days, 'mix': mix,
+            'seed': seed, 'message_bytes': len(text.encode()), 'stages': {}}
+
+    dt_list, times, peak = measure(of.parse_dt_string, text, repeat=repeat)
+    case['intervals'] = len(dt_list)
+    case['stages']['parse_dt_string'] = stage_report(times, peak)
+
+    for engine in engines:
+        if engine == of.LEGACY_ENGINE and people > legacy_max_people:
+            continue  # the legacy engine is combinatorial, it would not finish.
+        overlaps, times, peak = measure(of.find_all_common_intervals, dt_list, engine,
+                                        repeat=repeat)
+        case['stages'][f'find_all_common_intervals[{engine}]'] = stage_report(times, peak)
+        case[f'overlaps[{engine}]'] = len(overlaps)
+
+        text_out, times, peak = measure(of.format_overlaps, overlaps, repeat=repeat)
+        case['stages'][f'format_overlaps[{engine}]'] = stage_report(times, peak)
+        case[f'reply_bytes[{engine}]'] = len(text_out.encode())
+    return case
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--people', type=int, nargs='+', default=[5, 50, 500])
+    parser.add_argument('--slots', type=int, nargs='+', default=[3],
+                        help="slots per person")
+    parser.add_argument('--days', type=int, nargs='+', default=[7],
+                        help="day span of the slots")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help="e.g. absolute=3,relative=1,general=1")
+    parser.add_argument('--engines', nargs='+', default=[of.SWEEP_ENGINE, of.LEGACY_ENGINE],
+                        choices=[of.SWEEP_ENGINE, of.LEGACY_ENGINE])
+    parser.add_argument('--legacy-max-people', type=int, default=50,
+                        help="skip the legacy engine for larger groups")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    report = {
+        'timestamp': dt.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cases': [bench_case(people, slots, days, args.mix, args.engines, args.repeat,
+                             args.seed, args.legacy_max_people)
+                  for people, slots, days in itertools.product(args.people, args.slots,
+                                                               args.days)],
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Measures cold-start latency as JSON: the time to import each module in a fresh
+interpreter, and the time from starting app.py until its first reply.
+
+    python -m benchmarks.bench_startup --repeat 5 --output startup.json
+
+The first reply is requested with deliveryMode 'expectReplies', so the bot must run
+without an app id and password.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime as dt
+from time import perf_counter
+
+from aiohttp import ClientError, ClientSession
+
+import overlap_finder as of
+from benchmarks.load_test import make_activity
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "app.py")
+DEFAULT_MODULES = ["overlap_finder", "bot", "app"]
+
+IMPORT_SCRIPT = ("from time import perf_counter\n"
+                 "start = perf_counter()\n"
+                 "import {}\n"
+                 "print(perf_counter() - start)\n")
+
+
+def import_seconds(module):
+    """
+    :return: seconds to import module in a new interpreter, not counting the
+    interpreter's own startup.
+    """
+    out = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT.format(module)], cwd=ROOT,
+                         check=True, capture_output=True, text=True).stdout
+    return float(out.split()[-1])
+
+
+async def first_reply(port, timeout=60.0):
+    """
+    Starts app.py and posts EXAMPLE_MSG until it is answered.
+    :return: dict with seconds from starting the process until the first and second
+    replies.
+    """
+    env = dict(os.environ, Port=str(port))
+    url = f"http://localhost:{port}/api/messages"
+    start = perf_counter()
+    process = subprocess.Popen([sys.executable, APP_PATH], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL)
+    try:
+        async with ClientSession() as session:
+            while True:
+                try:
+                    async with session.post(url, json=make_activity(0, 0, of.EXAMPLE_MSG)) \
+                            as response:
+                        await response.read()
+                        if response.status == 200:
+                            break
+                except ClientError:
+                    pass
+                if process.poll() is not None or perf_counter() - start > timeout:
+                    raise RuntimeError("app.py did not reply")
+                await asyncio.sleep(0.01)
+            first = perf_counter() - start
+            # a new conversation, so that the result cache does not answer it.
+            async with session.post(url, json=make_activity(1, 1, of.EXAMPLE_MSG)) \
+                    as response:
+                await response.read()
+            second = perf_counter() - start - first
+    finally:
+        process.terminate()
+        process.wait()
+    return {'first_reply_s': first, 'second_reply_s': second}
+
+
+def summary(values):
+    return {'min_s': min(values), 'median_s': statistics.median(values)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modules', nargs='+', default=DEFAULT_MODULES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--port', type=int, default=3990)
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    imports = {module: summary([import_seconds(module) for _ in range(args.repeat)])
+               for module in args.modules}
+    runs = [asyncio.run(first_reply(args.port)) for _ in range(args.repeat)]
+    report = {
+        'timestamp': dt.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'imports': imports,
+        'first_reply': summary([run['first_reply_s'] for run in runs]),
+        'second_reply': summary([run['second_reply_s'] for run in runs]),
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Synthetic schedules in the bot's text format (see overlap_finder.FORMAT_MSG).
+
+    python -m benchmarks.generate_schedules --people 50 --slots 4 --days 7
+"""
+import argparse
+import random
+from datetime import datetime as dt
+from datetime import timedelta
+
+from overlap_finder import GENERAL_TIMESLOTS
+
+ABSOLUTE = 'absolute'  # '2 may 1:00pm-4:30pm' or '2 may 13:00-16:30'
+RELATIVE = 'relative'  # '2 may 13:00+2h30m'
+GENERAL = 'general'  # '2 may lunch'
+
+DEFAULT_MIX = {ABSOLUTE: 0.6, RELATIVE: 0.2, GENERAL: 0.2}
+
+
+def _date_str(day):
+    return f"{day.day} {day.strftime('%b').lower()}"
+
+
+def _time_str(hour, minute, twelve_hour):
+    if twelve_hour:
+        return f"{(hour - 1) % 12 + 1}:{minute:02d}{'am' if hour < 12 else 'pm'}"
+    return f"{hour}:{minute:02d}"
+
+
+def generate_slot(rng, day, kind):
+    """
+    :param rng: random.Random.
+    :param day: date of the slot.
+    :param kind: ABSOLUTE, RELATIVE or GENERAL.
+    :return: slot string.
+    """
+    if kind == GENERAL:
+        return f"{_date_str(day)} {rng.choice(sorted(GENERAL_TIMESLOTS))}"
+    start_hour = rng.randint(7, 20)
+    start_minute = rng.choice((0, 15, 30, 45))
+    if kind == RELATIVE:
+        hours = rng.randint(0, 3)
+        minutes = rng.choice((0, 30)) if hours else 30
+        dur = f"{hours}h{minutes}m" if minutes else f"{hours}h"
+        return f"{_date_str(day)} {_time_str(start_hour, start_minute, False)}+{dur}"
+    # end on the same day, parse_dt_string reads an earlier end-time as the next day.
+    end_hour = rng.randint(start_hour + 1, 23)
+    end_minute = rng.choice((0, 15, 30, 45))
+    twelve_hour = rng.random() < 0.5
+    return (f"{_date_str(day)} {_time_str(start_hour, start_minute, twelve_hour)}"
+            f"-{_time_str(end_hour, end_minute, twelve_hour)}")
+
+
+def generate_schedule(people, slots_per_person, days, mix=None, seed=0, start=None):
+    """
+    :param people: number of people.
+    :param slots_per_person: number of slots per person.
+    :param days: slots fall on one of this many days, starting from start.
+    :param mix: dict of slot kind to weight, defaults to DEFAULT_MIX.
+    :param seed: random seed, the same arguments always give the same schedule.
+    :param start: date of the first day, defaults to tomorrow.
+    :return: string in the format of overlap_finder.FORMAT_MSG.
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds, weights = zip(*mix.items())
+    start = start or (dt.today() + timedelta(days=1)).date()
+    lines = []
+    for person in range(people):
+        slots = []
+        for _ in range(slots_per_person):
+            day = start + timedelta(days=rng.randrange(days))
+            slots.append(generate_slot(rng, day, rng.choices(kinds, weights)[0]))
+        lines.append(f"Person-{person:03d}: " + ", ".join(slots) + ".")
+    return "\n".join(lines)
+
+
+def parse_mix(mix_str):
+    """ 'absolute=3,relative=1,general=1' -> dict. """
+    mix = dict()
+    for part in mix_str.split(','):
+        kind, weight = part.split('=')
+        if kind not in DEFAULT_MIX:
+            raise ValueError(f"unknown slot kind: {kind}")
+        mix[kind] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--people', type=int, default=10)
+    parser.add_argument('--slots', type=int, default=3, help="slots per person")
+    parser.add_argument('--days', type=int, default=7, help="day span of the slots")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help="e.g. absolute=3,relative=1,general=1")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(generate_schedule(args.people, args.slots, args.days, args.mix, args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Posts synthetic Bot Framework activities to /api/messages and reports throughput and
+latency as JSON. With --workers, starts cluster.py once per worker count, so that the
+runs show how throughput scales with the number of workers.
+
+    python -m benchmarks.load_test --workers 1 2 4 --requests 2000
+    python -m benchmarks.load_test --url http://localhost:3978 --requests 500
+
+Activities use deliveryMode 'expectReplies', so the replies come back in the response
+body and no channel is needed. The bot must run without an app id and password.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime as dt
+from time import perf_counter
+
+from aiohttp import ClientError, ClientSession
+
+from benchmarks.generate_schedules import DEFAULT_MIX, generate_schedule
+
+CLUSTER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            "cluster.py")
+# limits that would otherwise turn the load test away. can be overridden from the
+# environment.
+SPAWN_ENV = {
+    "RateLimitPerMinute": "1000000",
+    "RateLimitBurst": "1000000",
+    "MaxConcurrentMessages": "100000",
+    "BotMetrics": "0",
+}
+
+
+def make_activity(i, conversation, text):
+    return {
+        "type": "message",
+        "id": f"load-{i}",
+        "channelId": "loadtest",
+        "serviceUrl": "http://localhost",
+        "conversation": {"id": f"loadtest-{conversation}"},
+        "from": {"id": "user", "name": "user"},
+        "recipient": {"id": "bot", "name": "bot"},
+        "text": text,
+        "deliveryMode": "expectReplies",
+    }
+
+
+async def run_load(url, activities, concurrency):
+    """
+    :return: dict with the run's throughput, latency percentiles and status counts.
+    """
+    queue = asyncio.Queue()
+    for activity in activities:
+        queue.put_nowait(activity)
+    latencies = []
+    statuses = dict()
+
+    async def client(session):
+        while not queue.empty():
+            activity = queue.get_nowait()
+            start = perf_counter()
+            try:
+                async with session.post(url + "/api/messages", json=activity) as response:
+                    await response.read()
+                    status = response.status
+            except ClientError as e:
+                status = type(e).__name__
+            latencies.append(perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    async with ClientSession() as session:
+        start = perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        seconds = perf_counter() - start
+
+    cuts = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {'requests': len(activities), 'seconds': seconds,
+            'requests_per_s': len(activities) / seconds,
+            'latency_s': {'p50': cuts[49], 'p90': cuts[89], 'p99': cuts[98]},
+            'statuses': {str(status): n for status, n in sorted(statuses.items(), key=str)}}
+
+
+async def wait_ready(url, process, timeout=60.0):
+    deadline = perf_counter() + timeout
+    async with ClientSession() as session:
+        while perf_counter() < deadline and process.poll() is None:
+            try:
+                async with session.get(url + "/healthz") as response:
+                    if response.status == 200:
+                        return
+            except ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"cluster on {url} did not start")
+
+
+def run_workers(n_workers, port, activities, concurrency):
+    env = {**SPAWN_ENV, **os.environ, "BotWorkers": str(n_workers), "Port": str(port)}
+    process = subprocess.Popen([sys.executable, CLUSTER_PATH], env=env,
+                               stdout=subprocess.DEVNULL)
+    url = f"http://localhost:{port}"
+    try:
+        asyncio.run(wait_ready(url, process))
+        return dict(workers=n_workers, **asyncio.run(run_load(url, activities,
+                                                               concurrency)))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4],
+                        help="start cluster.py with each of these worker counts")
+    target.add_argument('--url', help="load a bot that is already running instead")
+    parser.add_argument('--port', type=int, default=3990,
+                        help="router port for --workers")
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--conversations', type=int, default=64)
+    parser.add_argument('--people', type=int, default=20)
+    parser.add_argument('--slots', type=int, default=3, help="slots per person")
+    parser.add_argument('--days', type=int, default=7, help="day span of the slots")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    # a different schedule per request, so that the result cache does not answer them.
+    activities = [make_activity(i, i % args.conversations,
+                                generate_schedule(args.people, args.slots, args.days,
+                                                  DEFAULT_MIX, args.seed + i))
+                  for i in range(args.requests)]
+    if args.url:
+        runs = [asyncio.run(run_load(args.url, activities, args.concurrency))]
+    else:
+        runs = [run_workers(n, args.port, activities, args.concurrency)
+                for n in args.workers]
+
+    report = {
+        'timestamp': dt.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'people': args.people, 'slots_per_person': args.slots, 'days': args.days,
+        'concurrency': args.concurrency, 'conversations': args.conversations,
+        'runs': runs,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
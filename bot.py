@@ -1,42 +1,300 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
-from botbuilder.core import ActivityHandler, TurnContext
+from botbuilder.core import ActivityHandler, ConversationState, MemoryStorage, TurnContext
 from botbuilder.schema import ChannelAccount, Activity
+import metrics
 import overlap_finder as of
+import tracing
+from result_cache import ResultCache
+from schedule_board import ScheduleBoard
+from worker_pool import WorkerPool, PoolBusyError, PoolTimeoutError
+
+TOO_LARGE_MSG = ("That schedule is too large for me to work through in time. "
+                 "Try splitting it into fewer people or dates.")
+
+TOO_MANY_INTERVALS_MSG = ("That schedule has {} time slots, more than the {} I can "
+                          "handle at once. Try splitting it into fewer people or dates.")
+
+BUSY_MSG = "I'm busy working on other schedules right now. Please try again in a bit."
+
+MORE_MSG = "{} more page(s) of common time slots. Type 'more' to see them."
+
+NO_MORE_MSG = "Nothing more to show."
+
+BEST_MSG = ("Too many common time slots? Start the message with\n"
+            "best K [min DURATION] [ppl N]\n"
+            "e.g. 'best 5 min 1h ppl 3' to see only the K slots with the most people, "
+            "then the longest ones.\n")
+
+QUORUM_MSG = ("Only interested in slots that enough people can make? Start the message "
+              "with\n"
+              "quorum N\n"
+              "e.g. 'quorum 6' to see only the slots shared by at least N people.\n")
+
+FREE_MSG = ("Looking for free time rather than every common slot? Start the message with\n"
+            "free DURATION [HH:MM-HH:MM] [ppl N]\n"
+            "e.g. 'free 1h 9:00-18:00' to see the windows of at least DURATION within "
+            "those hours each day, when everyone (or at least N people) is free.\n")
+
+TZ_MSG = ("In different time zones? Tag names with a zone, e.g. 'Amy@Asia/Singapore:', "
+          "and/or start the message with\n"
+          "tz ZONE\n"
+          "e.g. 'tz Europe/London' to read untagged times and show the common time slots "
+          "in that zone.\n")
+
+BOARD_MSG = ("You can also build the schedule up one person at a time:\n"
+             "add NAME: DATE TIME_SLOT1, DATE TIME_SLOT2.\n"
+             "to add or replace NAME's time slots,\n"
+             "remove NAME\n"
+             "to take NAME off the schedule,\n"
+             "show\n"
+             "to see the common time slots so far, and\n"
+             "clear\n"
+             "to start over.\n")
 
 
 class MyBot(ActivityHandler):
     # See https://aka.ms/about-bot-activity-message
     # to learn more about the message and other activity types.
 
+    def __init__(self, config, conversation_state: ConversationState = None):
+        self.overlap_engine = config.OVERLAP_ENGINE
+        self.metrics = config.METRICS
+        self.max_intervals = config.MAX_INTERVALS
+        self.pool = WorkerPool.from_config(config)
+        self.result_cache = ResultCache.from_config(config)
+        self.conversation_state = conversation_state or ConversationState(MemoryStorage())
+        self.board_accessor = self.conversation_state.create_property("ScheduleBoard")
+        self.pending_accessor = self.conversation_state.create_property("PendingPages")
+        # the last reply, kept in storage so that a restarted bot can still reuse it.
+        self.last_reply_accessor = self.conversation_state.create_property("LastReply")
+        self.page_chars = config.REPLY_PAGE_CHARS
+        self.pages_per_batch = config.REPLY_PAGES_PER_BATCH
+
     async def on_message_activity(self, turn_context: TurnContext):
+        await self.on_text(turn_context, turn_context.activity.text)
+
+    async def on_text(self, turn_context: TurnContext, text, zone=None):
+        """
+        Dispatches on the command that text starts with.
+        :param zone: zone name from a 'tz ZONE' prefix, for commands that follow it.
+        """
+        command, _, rest = text.strip().partition(' ')
+        command = command.lower()
 
-        if turn_context.activity.text.lower() in ['/help', 'help']:
+        if text.lower() in ['/help', 'help']:
             await turn_context.send_activity(Activity(type='message',
-                                                      text=of.help_msg(),
+                                                      text="\n".join([of.help_msg(), BEST_MSG,
+                                                                     QUORUM_MSG, FREE_MSG,
+                                                                     TZ_MSG,
+                                                                     BOARD_MSG]),
                                                       text_format='xml'))
-        elif turn_context.activity.text.lower() in ['/example', 'example', 'eg']:
+        elif text.lower() in ['/example', 'example', 'eg']:
             await turn_context.send_activity(Activity(type='message',
                                                       text=of.example_msg(),
                                                       text_format='xml'))
-        else:
+        elif command in ['add', 'remove', 'show', 'clear']:
+            await self.on_board_command(turn_context, command, rest, zone=zone)
+        elif text.lower().strip() in ['/more', 'more']:
+            pages = await self.pending_accessor.get(turn_context, list)
+            if pages:
+                await self.send_pages(turn_context, pages)
+            else:
+                await turn_context.send_activity(NO_MORE_MSG)
+        elif command == 'tz':
             try:
-                dt_list = of.parse_dt_string(turn_context.activity.text)
-                overlap_dict = of.find_all_common_intervals(dt_list)
-                to_print = of.format_overlaps(overlap_dict)
-                msg_activity = Activity(type='message', text=to_print,
-                                        text_format='xml')
-                # text_format='markdown' gives formatting issues w newlines.
-                # text_format='plain' auto becomes markdown in emulator. plain in Tele.
-                # text_format='xml' auto becomes plaintext in Telegram and emulator.
-                # note that with 'xml', anything encased in angular brackets are dropped.
-                # if argument to send_activity() is string, then markdown is assumed.
-                await turn_context.send_activity(msg_activity)
-
-            except Exception as e:
+                zone, rest = of.parse_tz_query(text)
+            except ValueError as e:
                 await turn_context.send_activity(str(e))
+                return
+            await self.on_text(turn_context, rest, zone)
+        elif command == 'best':
+            try:
+                query, schedule = of.parse_best_query(text)
+            except ValueError as e:
+                await turn_context.send_activity(str(e))
+                return
+            if schedule.strip():
+                await self.on_schedule(turn_context, schedule, query, zone=zone)
+            else:
+                await self.on_board_command(turn_context, 'show', '', query, zone=zone)
+        elif command == 'free':
+            try:
+                query, schedule = of.parse_free_query(text)
+            except ValueError as e:
+                await turn_context.send_activity(str(e))
+                return
+            if schedule.strip():
+                await self.on_schedule(turn_context, schedule, query, zone=zone)
+            else:
+                await self.on_board_command(turn_context, 'show', '', query, zone=zone)
+        elif command == 'quorum':
+            try:
+                min_people, schedule = of.parse_quorum_query(text)
+            except ValueError as e:
+                await turn_context.send_activity(str(e))
+                return
+            if schedule.strip():
+                await self.on_schedule(turn_context, schedule, min_people=min_people,
+                                       zone=zone)
+            else:
+                await self.on_board_command(turn_context, 'show', '', min_people=min_people,
+                                            zone=zone)
+        else:
+            await self.on_schedule(turn_context, text, zone=zone)
+
+    async def on_schedule(self, turn_context: TurnContext, text, query=None, min_people=2,
+                          zone=None):
+        """
+        Replies with the common time slots of the schedule in text.
+        :param query: overlap_finder.BestQuery, to reply with the best slots only, or
+        overlap_finder.FreeQuery, to reply with free windows.
+        :param min_people: quorum, to reply only with slots shared by this many people.
+        :param zone: zone name that untagged slots are read in and the reply is shown in.
+        """
+        conversation_id = turn_context.activity.conversation.id
+        trace = tracing.start_trace(conversation_id, force=self.metrics)
+        # parsing and solving share one WORKER_TIMEOUT.
+        deadline = self.pool.deadline()
+        try:
+            dt_list, key, trace = await self.pool.run(of.compute_intervals, text,
+                                                      self.overlap_engine, trace, zone,
+                                                      deadline=deadline)
+            if len(dt_list) > self.max_intervals:
+                raise ValueError(TOO_MANY_INTERVALS_MSG.format(len(dt_list),
+                                                               self.max_intervals))
+            cache_key = (conversation_id, key, query, min_people, zone)
+            pages = self.result_cache.get(cache_key)
+            if pages is None:
+                last_reply = await self.last_reply_accessor.get(turn_context, dict)
+                if last_reply.get('key') == repr(cache_key):
+                    pages = tuple(last_reply['pages'])
+                    trace.log("last reply hit")
+                else:
+                    pages, trace = await self.pool.run(of.compute_reply, dt_list,
+                                                       self.overlap_engine, trace, query,
+                                                       self.page_chars, min_people, zone,
+                                                       deadline=deadline)
+                    pages = tuple(pages)
+                    await self.last_reply_accessor.set(turn_context,
+                                                       {'key': repr(cache_key),
+                                                        'pages': list(pages)})
+                self.result_cache.put(cache_key, pages)
+            else:
+                trace.log("result cache hit: %s", self.result_cache.stats())
+            with trace.stage('send'):
+                await self.send_pages(turn_context, pages)
+
+        except PoolTimeoutError as e:
+            self.count_error(e)
+            await turn_context.send_activity(TOO_LARGE_MSG)
+        except PoolBusyError as e:
+            self.count_error(e)
+            await turn_context.send_activity(BUSY_MSG)
+        except Exception as e:
+            self.count_error(e)
+            await turn_context.send_activity(str(e))
+        finally:
+            # failed and timed out messages too, they tend to be the slowest.
+            if self.metrics:
+                metrics.observe_trace(trace)
+            trace.emit()
+
+    async def on_board_command(self, turn_context: TurnContext, command, rest, query=None,
+                               min_people=2, zone=None):
+        """
+        Updates the conversation's ScheduleBoard. Only the people named in the message
+        are touched, the rest of the board is kept as is.
+        :param query: overlap_finder.BestQuery, for 'show' to reply with the best slots only,
+        or overlap_finder.FreeQuery, to reply with free windows.
+        :param min_people: quorum, for 'show' to reply only with slots shared by this many
+        people.
+        :param zone: zone name that untagged slots are read in and 'show' replies in.
+        The board always holds UTC datetimes, so that people added with and without a
+        zone can be compared.
+        """
+        board = await self.board_accessor.get(turn_context, ScheduleBoard)
+        try:
+            if command == 'add':
+                dt_list, _, _ = await self.pool.run(of.compute_intervals, rest,
+                                                    self.overlap_engine, tracing.NULL_TRACE,
+                                                    zone or 'UTC')
+                by_name = dict()
+                for interval in dt_list:
+                    by_name.setdefault(interval.data, []).append(interval)
+                n_intervals = sum(len(slots) for name, slots in board.slots.items()
+                                  if name not in by_name) + len(dt_list)
+                if n_intervals > self.max_intervals:
+                    raise ValueError(TOO_MANY_INTERVALS_MSG.format(n_intervals,
+                                                                   self.max_intervals))
+                for name, intervals in by_name.items():
+                    board.set_person(name, intervals)
+                reply = (f"Updated {', '.join(sorted(by_name))}. "
+                         f"{len(board)} people on the schedule. Type 'show' to see "
+                         f"the common time slots.")
+            elif command == 'remove':
+                board.remove_person(rest.strip())
+                reply = f"Removed {rest.strip()}. {len(board)} people on the schedule."
+            elif command == 'clear':
+                board.clear()
+                reply = "Cleared the schedule."
+            else:
+                if isinstance(query, of.FreeQuery):
+                    pages, _ = await self.pool.run(of.compute_reply, board.intervals(),
+                                                   self.overlap_engine, tracing.NULL_TRACE,
+                                                   query, self.page_chars, min_people, zone)
+                else:
+                    if query is not None:
+                        min_people = max(min_people, query.min_people)
+                    # the board holds UTC, so say which zone the times are in.
+                    pages, _ = await self.pool.run(of.format_reply,
+                                                   board.overlaps(min_people),
+                                                   tracing.NULL_TRACE, query,
+                                                   self.page_chars, zone or 'UTC')
+                await self.send_pages(turn_context, pages)
+                return
+            await self.conversation_state.save_changes(turn_context, force=True)
+            await turn_context.send_activity(Activity(type='message', text=reply,
+                                                      text_format='xml'))
+        except PoolTimeoutError as e:
+            self.count_error(e)
+            await turn_context.send_activity(TOO_LARGE_MSG)
+        except PoolBusyError as e:
+            self.count_error(e)
+            await turn_context.send_activity(BUSY_MSG)
+        except Exception as e:
+            self.count_error(e)
+            await turn_context.send_activity(str(e))
+
+    def count_error(self, error):
+        """
+        Counts an error that was answered with a message, so that it still shows on
+        /metrics. Errors that reach app.on_error are counted there.
+        """
+        if self.metrics:
+            metrics.ERRORS.inc(type(error).__name__)
 
+    async def send_pages(self, turn_context: TurnContext, pages):
+        """
+        Sends the next batch of pages in one send_activities() call. The pages that are
+        left over are kept in conversation state for the 'more' command.
+        :param pages: sequence of strings, see overlap_finder.format_reply().
+        """
+        batch, rest = pages[:self.pages_per_batch], list(pages[self.pages_per_batch:])
+        # text_format='markdown' gives formatting issues w newlines.
+        # text_format='plain' auto becomes markdown in emulator. plain in Tele.
+        # text_format='xml' auto becomes plaintext in Telegram and emulator.
+        # note that with 'xml', anything encased in angular brackets are dropped.
+        # if argument to send_activity() is string, then markdown is assumed.
+        activities = [Activity(type='message', text=page, text_format='xml')
+                      for page in batch]
+        if rest:
+            activities.append(Activity(type='message', text=MORE_MSG.format(len(rest)),
+                                       text_format='xml'))
+        await self.pending_accessor.set(turn_context, rest)
+        await self.conversation_state.save_changes(turn_context, force=True)
+        await turn_context.send_activities(activities)
 
     async def on_members_added_activity(
         self,
@@ -0,0 +1,179 @@
+"""
+Runs the bot as several worker processes behind a router, to use more than one core.
+
+    BotWorkers=4 python cluster.py
+
+The router listens on PORT and forwards each activity to the worker that owns its
+conversation, so a conversation's result cache, rate limit bucket and state always
+stay in one worker. Workers run app.py on PORT + 1 + i and share nothing else.
+Unless WorkerPoolSize is set, the cores are split between the workers' pools, so
+that BotWorkers workers do not each start a pool as large as the machine.
+On SIGINT/SIGTERM the router stops taking new requests, lets in-flight ones finish,
+then stops the workers, which drain their own in-flight messages the same way.
+"""
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+from zlib import crc32
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, web
+from aiohttp.web import Request, Response, json_response
+
+from config import DefaultConfig
+
+CONFIG = DefaultConfig()
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+# response headers passed back from the workers.
+FORWARDED_HEADERS = ("Content-Type", "Retry-After")
+# seconds between checks for workers that died.
+MONITOR_INTERVAL = 1.0
+STARTUP_TIMEOUT = 30.0
+
+
+def worker_index(conversation_id, n_workers):
+    """
+    :return: index of the worker that owns conversation_id. stable across processes
+    and restarts, unlike hash().
+    """
+    return crc32(conversation_id.encode()) % n_workers
+
+
+class Worker:
+    """
+    One app.py process on its own port. Restarted by the router if it dies.
+    """
+
+    def __init__(self, index, port, pool_size):
+        self.index = index
+        self.port = port
+        self.pool_size = pool_size
+        self.url = f"http://localhost:{port}"
+        self.process = None
+        self.restarts = 0
+
+    def start(self):
+        env = {"WorkerPoolSize": str(self.pool_size), **os.environ, "Port": str(self.port)}
+        self.process = subprocess.Popen([sys.executable, APP_PATH], env=env)
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self, timeout):
+        """
+        Asks the worker to drain and exit, and kills it if it takes longer than timeout.
+        """
+        if not self.alive():
+            return
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class Router:
+    """
+    Forwards /api/messages to the workers by conversation id.
+    """
+
+    def __init__(self, config):
+        pool_size = max(1, (os.cpu_count() or 1) // config.WORKERS)
+        self.workers = [Worker(i, config.PORT + 1 + i, pool_size)
+                        for i in range(config.WORKERS)]
+        self.shutdown_timeout = config.SHUTDOWN_TIMEOUT
+        self.session = None
+        self._monitor = None
+
+    async def messages(self, req: Request) -> Response:
+        body = await req.read()
+        try:
+            conversation_id = json.loads(body)["conversation"]["id"]
+        except (ValueError, KeyError, TypeError):
+            conversation_id = ""
+        worker = self.workers[worker_index(conversation_id, len(self.workers))]
+        headers = {name: req.headers[name] for name in ("Content-Type", "Authorization")
+                   if name in req.headers}
+        try:
+            async with self.session.post(worker.url + "/api/messages", data=body,
+                                         headers=headers) as response:
+                return Response(status=response.status, body=await response.read(),
+                                headers={name: response.headers[name]
+                                         for name in FORWARDED_HEADERS
+                                         if name in response.headers})
+        except ClientError:
+            return Response(status=503, headers={"Retry-After": "1"})
+
+    async def healthz(self, req: Request) -> Response:
+        workers = []
+        for worker in self.workers:
+            status = {"port": worker.port, "restarts": worker.restarts}
+            try:
+                async with self.session.get(worker.url + "/healthz") as response:
+                    status.update(await response.json())
+            except (ClientError, ValueError):
+                status["status"] = "down"
+            workers.append(status)
+        ok = all(worker["status"] == "ok" for worker in workers)
+        return json_response(data={"status": "ok" if ok else "degraded",
+                                   "workers": workers},
+                             status=200 if ok else 503)
+
+    async def on_startup(self, app: web.Application):
+        self.session = ClientSession(timeout=ClientTimeout(total=self.shutdown_timeout))
+        for worker in self.workers:
+            worker.start()
+        await self._wait_ready()
+        self._monitor = asyncio.get_running_loop().create_task(self._restart_dead())
+
+    async def on_cleanup(self, app: web.Application):
+        self._monitor.cancel()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(None, worker.stop,
+                                                    self.shutdown_timeout)
+                               for worker in self.workers))
+        await self.session.close()
+
+    async def _wait_ready(self):
+        deadline = asyncio.get_running_loop().time() + STARTUP_TIMEOUT
+        for worker in self.workers:
+            while True:
+                try:
+                    async with self.session.get(worker.url + "/healthz") as response:
+                        if response.status == 200:
+                            break
+                except ClientError:
+                    pass
+                if not worker.alive() or asyncio.get_running_loop().time() > deadline:
+                    raise RuntimeError(f"worker {worker.index} on port {worker.port} "
+                                       f"did not start")
+                await asyncio.sleep(0.1)
+
+    async def _restart_dead(self):
+        while True:
+            await asyncio.sleep(MONITOR_INTERVAL)
+            for worker in self.workers:
+                if not worker.alive():
+                    print(f"worker {worker.index} exited with "
+                          f"{worker.process.returncode}, restarting", file=sys.stderr)
+                    worker.restarts += 1
+                    worker.start()
+
+
+def create_app(config):
+    router = Router(config)
+    app = web.Application(client_max_size=config.MAX_PAYLOAD_BYTES)
+    app.router.add_post("/api/messages", router.messages)
+    app.router.add_get("/healthz", router.healthz)
+    app.on_startup.append(router.on_startup)
+    app.on_cleanup.append(router.on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(CONFIG), host="localhost", port=CONFIG.PORT,
+                shutdown_timeout=CONFIG.SHUTDOWN_TIMEOUT)
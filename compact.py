@@ -0,0 +1,220 @@
+"""
+Compact, array-backed representation of intervals for the overlap core.
+
+Endpoints are int64 minutes since the epoch in parallel arrays, participant names are
+interned to small ints, and sets of participants are int bitsets (bit i is set if name
+i is in the set). Interval and datetime objects are only created again when a result is
+read, i.e. at the format_overlaps() boundary.
+"""
+import heapq
+from array import array
+from collections.abc import Mapping
+from datetime import datetime as dt
+from datetime import timedelta, timezone
+from warnings import warn
+
+from intervaltree import Interval
+
+EPOCH = dt(1970, 1, 1)
+MINUTE = timedelta(minutes=1)
+
+# sweep events are packed into one int: (minute << 1 | is_begin) << OWNER_BITS | owner.
+OWNER_BITS = 24
+OWNER_MASK = (1 << OWNER_BITS) - 1
+
+
+def to_minutes(d):
+    """
+    Minutes since EPOCH. Seconds are dropped, slots are minute-resolution
+    (overlap_finder.parse_dt_string() rejects slots with seconds).
+    Aware datetimes are counted from EPOCH in UTC.
+    """
+    if d.tzinfo is not None:
+        d = d.astimezone(timezone.utc).replace(tzinfo=None)
+    return (d - EPOCH) // MINUTE
+
+
+def from_minutes(minutes, tzinfo=None):
+    """
+    :param tzinfo: None for a naive datetime, else timezone.utc for an aware one.
+    """
+    d = EPOCH + minutes * MINUTE
+    return d if tzinfo is None else d.replace(tzinfo=tzinfo)
+
+
+class NameTable:
+    """ Interns names to small ints, in order of first appearance. """
+
+    def __init__(self):
+        self.names = []
+        self.ids = dict()
+
+    def intern(self, name):
+        idx = self.ids.get(name)
+        if idx is None:
+            idx = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return idx
+
+    def members(self, mask):
+        """
+        :param mask: int bitset of name ids.
+        :return: set of names.
+        """
+        result = set()
+        while mask:
+            low = mask & -mask
+            result.add(self.names[low.bit_length() - 1])
+            mask ^= low
+        return result
+
+
+class CompactIntervals:
+    """ Intervals as parallel arrays of begin/end minutes and owner ids. """
+
+    def __init__(self, names=None):
+        self.names = names or NameTable()
+        self.tzinfo = None  # timezone.utc if the intervals are aware (see parse_dt_string).
+        self.begins = array('q')
+        self.ends = array('q')
+        self.owners = array('l')
+
+    @classmethod
+    def from_intervals(cls, interval_list, names=None):
+        compact = cls(names)
+        for interval in interval_list:
+            compact.append(interval.begin, interval.end, interval.data)
+        return compact
+
+    def __len__(self):
+        return len(self.begins)
+
+    def append(self, begin, end, name):
+        if begin.tzinfo is not None:
+            self.tzinfo = timezone.utc
+        begin, end = to_minutes(begin), to_minutes(end)
+        if end < begin:
+            begin, end = end, begin
+            warn("interval: interval end is before begin")
+        self.begins.append(begin)
+        self.ends.append(end)
+        self.owners.append(self.names.intern(name))
+
+
+class CompactOverlaps(Mapping):
+    """
+    Common segments as parallel arrays of begin/end minutes and participant bitsets,
+    sorted by begin. Reads like the dict returned by find_all_common_intervals()
+    (key: Interval, value: set of names), converting entries as they are read.
+    """
+
+    def __init__(self, names, tzinfo=None):
+        self.names = names
+        self.tzinfo = tzinfo
+        self.begins = array('q')
+        self.ends = array('q')
+        self.masks = []
+        self._index = None  # key: (begin, end) minutes, value: position. built on demand.
+
+    def append(self, begin, end, mask):
+        self.begins.append(begin)
+        self.ends.append(end)
+        self.masks.append(mask)
+
+    def __len__(self):
+        return len(self.begins)
+
+    def __iter__(self):
+        for begin, end in zip(self.begins, self.ends):
+            yield Interval(from_minutes(begin, self.tzinfo), from_minutes(end, self.tzinfo))
+
+    def __getitem__(self, interval):
+        if self._index is None:
+            self._index = {key: i for i, key in enumerate(zip(self.begins, self.ends))}
+        try:
+            i = self._index[(to_minutes(interval.begin), to_minutes(interval.end))]
+        except (AttributeError, TypeError):
+            raise KeyError(interval)
+        return self.names.members(self.masks[i])
+
+    def items(self):
+        for begin, end, mask in zip(self.begins, self.ends, self.masks):
+            yield (Interval(from_minutes(begin, self.tzinfo), from_minutes(end, self.tzinfo)),
+                   self.names.members(mask))
+
+
+    def best(self, k, min_people=2, min_minutes=0):
+        """
+        Selects the k best segments, ranked by number of people, then by duration, then
+        by begin. Only the selected segments are converted.
+        :return: list of (Interval, set of names), best first.
+        """
+        candidates = ((-bin(mask).count('1'), begin - end, begin, end, mask)
+                      for begin, end, mask in zip(self.begins, self.ends, self.masks)
+                      if end - begin >= min_minutes)
+        if min_people > 2:
+            candidates = (c for c in candidates if -c[0] >= min_people)
+        return [(Interval(from_minutes(begin, self.tzinfo), from_minutes(end, self.tzinfo)),
+                 self.names.members(mask))
+                for _, _, begin, end, mask in heapq.nsmallest(k, candidates)]
+
+
+def sweep(compact, min_people=2):
+    """
+    Sort-and-sweep over the begin/end events of compact. Between two consecutive event
+    times the set of participants is constant, so each stretch with min_people or more
+    participants is a common segment. Neighbouring stretches with the same participants
+    are merged so that every segment is maximal. Runs in O(n log n + output).
+
+    Stretches below the quorum are dropped as soon as the sweep reaches them, so only
+    segments that can be part of the result are ever recorded.
+    :param compact: CompactIntervals.
+    :param min_people: quorum, at least 2.
+    :return: CompactOverlaps.
+    """
+    result = CompactOverlaps(compact.names, compact.tzinfo)
+    min_people = max(min_people, 2)
+    if len(set(compact.owners)) < min_people:
+        return result  # the quorum can never be reached.
+
+    events = []
+    for begin, end, owner in zip(compact.begins, compact.ends, compact.owners):
+        if begin == end:
+            continue
+        events.append(((begin << 1 | 1) << OWNER_BITS) | owner)
+        events.append(((end << 1) << OWNER_BITS) | owner)
+    # ends sort before begins at the same time, so touching intervals don't overlap.
+    events.sort()
+
+    active = dict()  # key: owner id, value: number of open intervals of that owner.
+    mask = 0  # bitset of owners with at least one open interval.
+    n_active = 0
+    seg_begin = seg_mask = 0  # seg_mask == 0 while no segment is open.
+    prev_time = None
+
+    for event in events:
+        time = event >> (OWNER_BITS + 1)
+        if time != prev_time and prev_time is not None:
+            current = mask if n_active >= min_people else 0
+            if current != seg_mask:
+                if seg_mask:
+                    result.append(seg_begin, prev_time, seg_mask)
+                seg_begin, seg_mask = prev_time, current
+        owner = event & OWNER_MASK
+        if event >> OWNER_BITS & 1:
+            count = active.get(owner, 0)
+            if not count:
+                mask |= 1 << owner
+                n_active += 1
+            active[owner] = count + 1
+        else:
+            count = active[owner] - 1
+            active[owner] = count
+            if not count:
+                mask ^= 1 << owner
+                n_active -= 1
+        prev_time = time
+
+    if seg_mask:
+        result.append(seg_begin, prev_time, seg_mask)
+    return result
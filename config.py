@@ -7,6 +7,62 @@ import os
 class DefaultConfig:
     """ Bot Configuration """
 
-    PORT = 3978
+    PORT = int(os.environ.get("Port", 3978))
     APP_ID = os.environ.get("MicrosoftAppId", "")
     APP_PASSWORD = os.environ.get("MicrosoftAppPassword", "")
+
+    # 'sweep' (default) or 'legacy'. See overlap_finder.find_all_common_intervals().
+    OVERLAP_ENGINE = os.environ.get("OverlapEngine", "sweep")
+
+    # set to log per-message stage timings to the 'eventboybot.trace' logger.
+    TRACE = os.environ.get("BotTrace", "") not in ("", "0", "false")
+
+    # per-stage latency histograms on /metrics. these need stage timings for every
+    # message, so they are collected even when TRACE is off.
+    METRICS = os.environ.get("BotMetrics", "1") not in ("", "0", "false")
+
+    # parsing and overlap search run in a worker pool, off the event loop.
+    # 'process' (default) or 'thread'.
+    WORKER_POOL = os.environ.get("WorkerPool", "process")
+    # cluster.py splits the cores between its workers unless this is set.
+    WORKER_POOL_SIZE = int(os.environ.get("WorkerPoolSize", os.cpu_count() or 1))
+    # jobs allowed to wait for a free worker before messages are turned away.
+    WORKER_QUEUE_SIZE = int(os.environ.get("WorkerQueueSize", 32))
+    # seconds before a message is answered with TOO_LARGE_MSG, over all its jobs.
+    WORKER_TIMEOUT = float(os.environ.get("WorkerTimeout", 10))
+
+    # admission control for /api/messages.
+    MAX_PAYLOAD_BYTES = int(os.environ.get("MaxPayloadBytes", 64 * 1024))
+    # schedules with more intervals are turned away before the overlap stage.
+    MAX_INTERVALS = int(os.environ.get("MaxIntervals", 5000))
+    # per conversation: sustained messages per minute, and how many may come at once.
+    RATE_LIMIT_PER_MINUTE = float(os.environ.get("RateLimitPerMinute", 30))
+    RATE_LIMIT_BURST = int(os.environ.get("RateLimitBurst", 10))
+    # messages handled at the same time, over all conversations.
+    MAX_CONCURRENT_MESSAGES = int(os.environ.get("MaxConcurrentMessages", 64))
+
+    # replies to schedules that were already solved in the same conversation.
+    RESULT_CACHE_ENTRIES = int(os.environ.get("ResultCacheEntries", 1024))
+    RESULT_CACHE_BYTES = int(os.environ.get("ResultCacheBytes", 16 * 1024 * 1024))
+    RESULT_CACHE_TTL = float(os.environ.get("ResultCacheTtl", 3600))
+
+    # long replies are split into pages of at most this many characters, and sent a
+    # few pages at a time. the rest are sent on 'more'.
+    REPLY_PAGE_CHARS = int(os.environ.get("ReplyPageChars", 4000))
+    REPLY_PAGES_PER_BATCH = int(os.environ.get("ReplyPagesPerBatch", 3))
+
+    # where conversation state (schedule boards, pending pages, last replies) is kept.
+    # 'memory' (default) is lost on restart, 'sqlite' is kept in STORAGE_PATH.
+    STORAGE = os.environ.get("BotStorage", "memory")
+    STORAGE_PATH = os.environ.get("BotStoragePath", "eventboybot.sqlite3")
+    # writes are batched: flushed after this many seconds, or once this many are waiting.
+    STORAGE_FLUSH_INTERVAL = float(os.environ.get("StorageFlushInterval", 1))
+    STORAGE_BATCH_SIZE = int(os.environ.get("StorageBatchSize", 100))
+    # conversations kept in memory in front of the file.
+    STORAGE_CACHE_ENTRIES = int(os.environ.get("StorageCacheEntries", 10000))
+
+    # worker processes started by cluster.py. the router listens on PORT, and worker i
+    # on PORT + 1 + i. each worker's pool gets WORKER_POOL_SIZE = cores / WORKERS.
+    WORKERS = int(os.environ.get("BotWorkers", os.cpu_count() or 1))
+    # seconds that in-flight messages get to finish when shutting down.
+    SHUTDOWN_TIMEOUT = float(os.environ.get("ShutdownTimeout", 30))
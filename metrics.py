@@ -0,0 +1,148 @@
+"""
+Minimal metrics registry rendered in the Prometheus text exposition format.
+See https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+from bisect import bisect_left
+
+# seconds.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+# intervals or overlaps in one message.
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# trace stage names (see tracing.MessageTrace) -> the function they time.
+STAGE_FUNCTIONS = {'split': 'parse_dt_string', 'parse': 'parse_dt_string',
+                   'overlap': 'find_all_common_intervals', 'format': 'format_overlaps'}
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.values = dict()  # key: tuple of label values.
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for label_values in sorted(self.values):
+            lines.extend(self._render_one(label_values))
+        return lines
+
+    def _render_one(self, label_values):
+        labels = _format_labels(self.labels, label_values)
+        return [f"{self.name}{labels} {self.values[label_values]}"]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        entry = self.values.get(label_values)
+        if entry is None:
+            # per-bucket counts (non-cumulative, last one is +Inf), sum, count.
+            entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def _render_one(self, label_values):
+        counts, total, count = self.values[label_values]
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + ('+Inf',), counts):
+            cumulative += n
+            labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labels, label_values)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    'eventboybot_requests_total', "HTTP requests handled.", ['handler', 'status']))
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    'eventboybot_request_seconds', "HTTP request latency.", ['handler']))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    'eventboybot_requests_in_flight', "HTTP requests being handled.", ['handler']))
+ERRORS = REGISTRY.register(Counter(
+    'eventboybot_errors_total', "Failed messages and unhandled errors, by exception type.",
+    ['type']))
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    'eventboybot_stage_seconds', "Time spent per message in each overlap_finder stage.",
+    ['stage']))
+INTERVALS = REGISTRY.register(Histogram(
+    'eventboybot_intervals_per_message', "Intervals parsed per message.",
+    buckets=COUNT_BUCKETS))
+OVERLAPS = REGISTRY.register(Histogram(
+    'eventboybot_overlaps_per_message', "Common intervals found per message.",
+    buckets=COUNT_BUCKETS))
+
+
+def observe_trace(trace):
+    """
+    Records the stage timings and counts of a finished tracing.MessageTrace.
+    """
+    per_function = dict()
+    for stage, secs in trace.timings.items():
+        function = STAGE_FUNCTIONS.get(stage)
+        if function is not None:
+            per_function[function] = per_function.get(function, 0.0) + secs
+    for function, secs in per_function.items():
+        STAGE_LATENCY.observe(secs, function)
+    if 'intervals' in trace.counts:
+        INTERVALS.observe(trace.counts['intervals'])
+    if 'overlaps' in trace.counts:
+        OVERLAPS.observe(trace.counts['overlaps'])
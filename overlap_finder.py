@@ -1,10 +1,19 @@
+import heapq
 import re
-import dateutil.parser as dtp
+from collections import namedtuple
+
 from datetime import datetime as dt
 from datetime import timedelta
+from functools import lru_cache
+from hashlib import sha1
+from itertools import groupby
 from intervaltree import Interval, IntervalTree
 from warnings import warn
 
+import compact
+import timezones as tz
+from tracing import NULL_TRACE
+
 HELP_MSG = ("Hi! I can help you find ALL the common time slots from a list of free time "
             "slots tagged to each named person.\n\n")
 
@@ -12,7 +21,10 @@ FORMAT_MSG = ("Expected format:\n"
               "NAME1: DATE TIME_SLOT1, DATE TIME_SLOT2.\n"
               "NAME2: DATE TIME_SLOT1, DATE TIME_SLOT2.\n\n"
               "For TIME, hours and mins MUST be separated by ':' or time will "
-              "be interpreted wrongly.\n"
+              "be interpreted wrongly. Times are to the minute, seconds are not "
+              "accepted.\n"
+              "For slots that repeat, use e.g. 'every tue 18:00-20:00 until 30 jun' "
+              "or 'weekdays lunch'.\n"
               "Type 'example' for example input. Copy-paste example input to see what "
               "I can do! You can specify ur timeslots in many ways :).\n")
 
@@ -32,17 +44,161 @@ EXAMPLE_MSG = ("Amy-likes-12h:\n"
                "may 2 1:00pm-3:30pm."
                )
 
-GENERAL_TIMESLOTS = {'breakfast', 'brunch', 'lunch', 'dinner', 'supper', 'morning',
-                     'afternoon', 'night'}
+BEST_FORMAT_MSG = ("Expected format:\n"
+                   "best K [min DURATION] [ppl N]\n"
+                   "followed by the schedule, e.g. 'best 5 min 1h30m ppl 3'. "
+                   "Without a schedule, the slots added with 'add' are used.\n")
+
+OVERLAPS_HEADER = "Common dates & times:\n"
+BEST_HEADER = "Best dates & times:\n"
+FREE_HEADER = "Free dates & times:\n"
+
+# Telegram rejects messages longer than 4096 characters.
+PAGE_CHARS = 4000
+
+RECURRENCE_FORMAT_MSG = ("Expected format for recurring time slots:\n"
+                         "every DAY TIME_SLOT [until DATE]\n"
+                         "where DAY is e.g. 'tue', 'day', 'weekday' or 'weekend', and "
+                         "TIME_SLOT is e.g. '18:00-20:00', '9:00am+1h' or 'lunch'. "
+                         "'weekdays lunch' and 'daily 9:00+1h' work too.\n")
+
+TZ_FORMAT_MSG = ("Expected format:\n"
+                 "tz ZONE\n"
+                 "followed by the schedule, e.g. 'tz Asia/Singapore'. Times of people "
+                 "without a zone tag (e.g. 'Amy@Europe/London:') are read in ZONE, and "
+                 "the common time slots are shown in ZONE.\n")
+
+FREE_FORMAT_MSG = ("Expected format:\n"
+                   "free DURATION [HH:MM-HH:MM] [ppl N]\n"
+                   "followed by the schedule, e.g. 'free 1h 9:00-18:00 ppl 3' for windows "
+                   "of at least DURATION within those hours each day, when at least N "
+                   "people (or everyone) are free. "
+                   "Without a schedule, the slots added with 'add' are used.\n")
+
+QUORUM_FORMAT_MSG = ("Expected format:\n"
+                     "quorum N\n"
+                     "followed by the schedule, e.g. 'quorum 6'. "
+                     "Without a schedule, the slots added with 'add' are used.\n")
+
+# key: general timeslot, value: (start hour, duration).
+GENERAL_TIMESLOTS = {
+    'breakfast': (8, timedelta(hours=2, minutes=30)),
+    'brunch': (11, timedelta(hours=2, minutes=30)),
+    'lunch': (12, timedelta(hours=2, minutes=30)),
+    'dinner': (18, timedelta(hours=2, minutes=30)),
+    'supper': (21, timedelta(hours=2, minutes=30)),
+    'morning': (8, timedelta(hours=4)),
+    'afternoon': (12, timedelta(hours=6)),
+    'night': (19, timedelta(hours=5)),
+}
 
 ZERO_DUR = timedelta()
 
+DUR_REGEX = re.compile(r'((?P<hours>\d+?)h)?((?P<minutes>\d+?)m)?((?P<seconds>\d+?)s)?')
+
+MONTHS = {'jan': 1, 'january': 1, 'feb': 2, 'february': 2, 'mar': 3, 'march': 3,
+          'apr': 4, 'april': 4, 'may': 5, 'jun': 6, 'june': 6, 'jul': 7, 'july': 7,
+          'aug': 8, 'august': 8, 'sep': 9, 'sept': 9, 'september': 9, 'oct': 10,
+          'october': 10, 'nov': 11, 'november': 11, 'dec': 12, 'december': 12}
+
+_MONTH_PATTERN = '|'.join(sorted(MONTHS, key=len, reverse=True))
+# DATE is 'DAY MONTH' or 'MONTH DAY'. TIME is 'HH:MM[:SS][am|pm]'. Either may be missing.
+DT_REGEX = re.compile(
+    r'^(?:(?P<date>(?P<day_a>\d{1,2})(?:st|nd|rd|th)?\s+(?P<month_a>MONTH)'
+    r'|(?P<month_b>MONTH)\s+(?P<day_b>\d{1,2})(?:st|nd|rd|th)?)(?:\s+|$))?'
+    r'(?P<time>(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?'
+    r'\s*(?P<meridiem>am|pm)?)?$'.replace('MONTH', _MONTH_PATTERN))
+
+BEST_REGEX = re.compile(r'^\s*best\s+(?P<k>\d+)(?:\s+min\s+(?P<min_dur>\w+))?'
+                        r'(?:\s+ppl\s+(?P<min_people>\d+))?(?:\s+|$)', re.IGNORECASE)
+
+WEEKDAYS = {'mon': {0}, 'tue': {1}, 'wed': {2}, 'thu': {3}, 'fri': {4}, 'sat': {5},
+            'sun': {6}, 'day': set(range(7)), 'daily': set(range(7)),
+            'weekday': set(range(5)), 'weekdays': set(range(5)),
+            'weekend': {5, 6}, 'weekends': {5, 6}}
+
+_WEEKDAY_PATTERN = 'mon|tue|wed|thu|fri|sat|sun|day|weekdays?|weekends?'
+RECURRENCE_REGEX = re.compile(
+    r'^\s*(?P<days>every\s+(?:' + _WEEKDAY_PATTERN + r')|weekdays|weekends|daily)\s+'
+    r'(?P<slot>.+?)(?:\s+until\s+(?P<until>.+?))?\s*$', re.IGNORECASE)
+
+# recurring slots of name, on weekdays (0 is monday), from hour:minute for duration,
+# until the date until (inclusive, or None). zone is name's zone tag, or None.
+Recurrence = namedtuple('Recurrence', ['name', 'zone', 'weekdays', 'hour', 'minute',
+                                       'duration', 'until'])
+
+# recurring slots are expanded this far ahead when no other slots bound the window.
+RECURRENCE_HORIZON = timedelta(days=28)
+
+TZ_REGEX = re.compile(r'^\s*tz\s+(?P<zone>\S+)(?:\s+|$)', re.IGNORECASE)
+
+QUORUM_REGEX = re.compile(r'^\s*quorum\s+(?P<min_people>\d+)(?:\s+|$)', re.IGNORECASE)
+
+# k best common intervals with at least min_people people and min_dur duration.
+BestQuery = namedtuple('BestQuery', ['k', 'min_people', 'min_dur'])
+
+FREE_REGEX = re.compile(r'^\s*free\s+(?P<duration>\w+)'
+                        r'(?:\s+(?P<day_begin>\d{1,2}:\d{2})\s*-'
+                        r'\s*(?P<day_end>\d{1,2}:\d{2}))?'
+                        r'(?:\s+ppl\s+(?P<min_people>\d+))?(?:\s+|$)', re.IGNORECASE)
+
+# windows of at least duration when at least min_people people (None for everyone) are
+# free, within day_begin..day_end each day (timedeltas since midnight, or None for all
+# day). see find_free_windows().
+FreeQuery = namedtuple('FreeQuery', ['duration', 'day_begin', 'day_end', 'min_people'])
+
+# number of distinct DATE TIME strings remembered by tokenize_dt().
+DT_CACHE_SIZE = 4096
+
+# engines accepted by find_all_common_intervals().
+LEGACY_ENGINE = 'legacy'
+SWEEP_ENGINE = 'sweep'
+DEFAULT_ENGINE = SWEEP_ENGINE
+
 
-def find_all_common_intervals(interval_list):
+def find_all_common_intervals(interval_list, engine=DEFAULT_ENGINE, min_people=2):
     """
     Finds common intervals (overlapping regions) and labels common intervals with
     intersecting intervals' data attribute (e.g. the user id)
     :param interval_list: list of Interval objects
+    :param engine: SWEEP_ENGINE (default) returns the maximal segments over which the
+    set of participants stays the same. LEGACY_ENGINE runs the original pairwise search,
+    kept so that the outputs of both engines can be compared.
+    :param min_people: quorum. only common intervals shared by at least this many people
+    are returned.
+    :return: a dict (key: Interval, value: set of user_ids which share that interval)
+    """
+    if engine == SWEEP_ENGINE:
+        return sweep_common_intervals(interval_list, min_people)
+    elif engine == LEGACY_ENGINE:
+        overlap_dict = legacy_common_intervals(interval_list)
+        if min_people > 2:
+            # the pairwise search cannot prune, a small overlap may still grow later.
+            overlap_dict = {interval: ids for interval, ids in overlap_dict.items()
+                            if len(ids) >= min_people}
+        return overlap_dict
+    raise ValueError(f"unknown overlap engine: {engine}")
+
+
+def sweep_common_intervals(interval_list, min_people=2):
+    """
+    Sort-and-sweep over the begin/end events of all intervals, on the compact
+    array-backed representation (see compact.sweep()). Neighbouring stretches with the
+    same participants are merged so that every returned segment is maximal.
+    Runs in O(n log n + output).
+    :param interval_list: list of Interval objects
+    :param min_people: quorum, see find_all_common_intervals().
+    :return: compact.CompactOverlaps, which reads like a dict (key: Interval, value: set
+    of user_ids which share that interval).
+    """
+    return compact.sweep(compact.CompactIntervals.from_intervals(interval_list), min_people)
+
+
+def legacy_common_intervals(interval_list):
+    """
+    Original pairwise overlap search. Every interval is compared against every overlap
+    found so far, so this grows combinatorially with the number of people.
+    :param interval_list: list of Interval objects
     :return: a dict (key: Interval, value: set of user_ids which share that interval)
     """
     overlap_dict = dict()
@@ -158,6 +314,110 @@ def find_overlap(interval_a, interval_b):
     return Interval(common_begin, common_end)
 
 
+def find_free_windows(interval_list, duration, window_begin=None, window_end=None,
+                      day_begin=None, day_end=None, min_people=None, zone_name=None):
+    """
+    Finds windows of at least duration in which at least min_people people are free
+    throughout, within window_begin..window_end and day_begin..day_end each day.
+
+    Each person's slots are merged into their coverage (IntervalTree.merge_overlaps()),
+    which is clipped to the daily hours by searching a tree of them, and all people's
+    clipped coverage is swept once. Whenever someone leaves, the longest window ending
+    then with min_people people who were free throughout it is returned, labelled with
+    everyone who was. Common intervals are never enumerated.
+    :param interval_list: list of Interval objects.
+    :param duration: timedelta, the shortest window returned.
+    :param window_begin: datetime, defaults to the earliest slot begin.
+    :param window_end: datetime, defaults to the latest slot end.
+    :param day_begin: timedelta since midnight. with day_end, only this part of each day
+    is searched. defaults to searching whole days.
+    :param day_end: timedelta since midnight. if not after day_begin, the hours run over
+    midnight, e.g. 22:00-02:00.
+    :param min_people: defaults to everyone in interval_list.
+    :param zone_name: zone that day_begin and day_end are wall times in, for aware
+    datetimes. defaults to UTC.
+    :return: a dict (key: Interval, value: set of names free throughout that interval),
+    like find_all_common_intervals().
+    """
+    by_name = dict()
+    for interval in interval_list:
+        by_name.setdefault(interval.data, []).append(interval)
+    if not by_name:
+        return dict()
+    if min_people is None:
+        min_people = len(by_name)
+    min_people = max(min_people, 1)
+    if window_begin is None:
+        window_begin = min(interval.begin for interval in interval_list)
+    if window_end is None:
+        window_end = max(interval.end for interval in interval_list)
+    mask = daily_mask(window_begin, window_end, day_begin, day_end, zone_name)
+
+    events = []  # (time, is_begin, name)
+    for name, intervals in by_name.items():
+        coverage = IntervalTree(Interval(interval.begin, interval.end)
+                                for interval in intervals if interval.begin < interval.end)
+        coverage.merge_overlaps()
+        for covered in coverage:
+            for hours in mask.search(covered.begin, covered.end):
+                begin, end = max(covered.begin, hours.begin), min(covered.end, hours.end)
+                if begin < end:
+                    events.append((begin, True, name))
+                    events.append((end, False, name))
+    events.sort(key=lambda event: event[0])
+
+    free_dict = dict()
+    arrivals = dict()  # key: name, value: time since which name is free without a break.
+    for time, group in groupby(events, key=lambda event: event[0]):
+        leaving, joining = set(), set()
+        for _, is_begin, name in group:
+            (joining if is_begin else leaving).add(name)
+        # e.g. a slot that ends where the next one begins, across two mask intervals.
+        both = leaving & joining
+        leaving -= both
+        joining -= both
+        if leaving and len(arrivals) >= min_people:
+            begin = heapq.nsmallest(min_people, arrivals.values())[-1]
+            names = {name for name, arrival in arrivals.items() if arrival <= begin}
+            # if no one in the window leaves, it goes on and is returned later.
+            if not leaving.isdisjoint(names) and time - begin >= duration:
+                free_dict[Interval(begin, time)] = names
+        for name in leaving:
+            del arrivals[name]
+        for name in joining:
+            arrivals[name] = time
+    return free_dict
+
+
+def daily_mask(window_begin, window_end, day_begin=None, day_end=None, zone_name=None):
+    """
+    :return: IntervalTree of the day_begin..day_end hours of each day within
+    window_begin..window_end. See find_free_windows().
+    """
+    if day_begin is None or day_end is None:
+        return IntervalTree([Interval(window_begin, window_end)])
+    if day_end <= day_begin:
+        day_end += timedelta(days=1)
+    aware = window_begin.tzinfo is not None
+    zone_name = zone_name or 'UTC'
+    local_begin, local_end = window_begin, window_end
+    if aware:
+        local_begin = tz.to_local(window_begin, zone_name).replace(tzinfo=None)
+        local_end = tz.to_local(window_end, zone_name).replace(tzinfo=None)
+    # from the day before, for hours that run over midnight into the window.
+    day = dt.combine(local_begin.date(), dt.min.time()) - timedelta(days=1)
+    mask = IntervalTree()
+    while day < local_end:
+        begin, end = day + day_begin, day + day_end
+        if aware:
+            begin, end = tz.to_utc(begin, zone_name), tz.to_utc(end, zone_name)
+        begin, end = max(begin, window_begin), min(end, window_end)
+        if begin < end:
+            mask.add(Interval(begin, end))
+        day += timedelta(days=1)
+    return mask
+
+
 def sortby_start(interval_keys):
     """
     Sort keys based on start of interval, in ascending order
@@ -173,7 +433,7 @@ def sortby_start(interval_keys):
     return sorted_keys
 
 
-def format_overlaps(overlap_dict):
+def format_overlaps(overlap_dict, display_tz=None):
     """
     Formats a string representation of a dict where the key is a Datetime Interval
     and the value is the set of associated user names.
@@ -181,39 +441,183 @@ def format_overlaps(overlap_dict):
     on the Activity.text_format field.
 
     :param overlap_dict. key is Datetime Interval, value is set of userids.
+    :param display_tz: zone name to show aware datetimes in, e.g. 'Asia/Singapore'.
     :return: string.
     """
-    sorted_keys = sortby_start(overlap_dict.keys())
-    # TODO: include other sort options. e.g. sort by duration.
-    blocks = []
-    header = "Common dates & times:\n"
-    
-    for interval in sorted_keys:
-        sorted_ids = sorted(overlap_dict[interval])
-        userids = ", ".join(sorted_ids)
-        dur = interval.end - interval.begin
-        dur_in_min = dur.total_seconds() / 60
-        dur_in_hours = dur_in_min / 60
-
-        if interval.begin.date() == interval.end.date():
-            blocks.append(f"{interval.begin.strftime('**%d %b, %I:%M%p')}"
-                          f" - {interval.end.strftime('%I:%M%p')}"
-                          f" ({dur_in_hours:.1f}h)**\n")
-        else:
-            blocks.append(f"{interval.begin.strftime('**%d %b, %I:%M%p')}"
-                          f" - {interval.end.strftime('%d %b, %I:%M%p')}"
-                          f" ({dur_in_hours:.1f}h)**\n")
-
-        blocks[-1] = blocks[-1] + f"   ppl: {str(userids)}\n"
     empty_line = "\n"
-    fstring = header + empty_line.join(blocks)
+    fstring = (format_header(OVERLAPS_HEADER, display_tz)
+               + empty_line.join(iter_overlap_blocks(overlap_dict, display_tz)))
 
     return fstring
 
 
+def iter_overlap_blocks(overlap_dict, display_tz=None):
+    """
+    Yields the formatted blocks of format_overlaps() one at a time, sorted by start.
+    :param overlap_dict. key is Datetime Interval, value is set of userids.
+    :param display_tz: see format_overlaps().
+    :return: generator of strings.
+    """
+    if isinstance(overlap_dict, compact.CompactOverlaps):
+        # already sorted by start, and converted one entry at a time.
+        items = overlap_dict.items()
+    else:
+        items = ((interval, overlap_dict[interval])
+                 for interval in sortby_start(overlap_dict.keys()))
+    # for sorting by number of people and duration, see best_slots().
+    for interval, userids in items:
+        yield format_block(interval, userids, display_tz)
+
+
+def paginate(blocks, header='', max_chars=PAGE_CHARS):
+    """
+    Packs blocks into pages of at most max_chars characters, for channels that truncate
+    or reject long messages. Blocks are never split, so a block longer than max_chars
+    gets a page of its own.
+    :param blocks: iterable of strings, e.g. iter_overlap_blocks().
+    :param header: string that starts the first page.
+    :param max_chars: int.
+    :return: generator of strings.
+    """
+    prefix = header
+    page = []
+    size = len(prefix)
+    for block in blocks:
+        extra = len(block) + (1 if page else 0)  # + 1 for the empty line between blocks.
+        if page and size + extra > max_chars:
+            yield prefix + "\n".join(page)
+            prefix, page, size = '', [], 0
+            extra = len(block)
+        page.append(block)
+        size += extra
+    yield prefix + "\n".join(page)
+
+
+def format_header(header, display_tz=None):
+    """
+    :return: header, naming display_tz if given. e.g. 'Common dates & times (UTC):'
+    """
+    if display_tz is None:
+        return header
+    return header.replace(":\n", f" ({display_tz}):\n", 1)
+
+
+def format_block(interval, userids, display_tz=None):
+    """
+    Formats one common interval and the names that share it.
+    :param interval: Datetime Interval.
+    :param userids: set of userids.
+    :param display_tz: see format_overlaps().
+    :return: string.
+    """
+    if display_tz is not None and interval.begin.tzinfo is not None:
+        interval = Interval(tz.to_local(interval.begin, display_tz),
+                            tz.to_local(interval.end, display_tz))
+    userids = ", ".join(sorted(userids))
+    dur = interval.end - interval.begin
+    dur_in_min = dur.total_seconds() / 60
+    dur_in_hours = dur_in_min / 60
+
+    if interval.begin.date() == interval.end.date():
+        block = (f"{interval.begin.strftime('**%d %b, %I:%M%p')}"
+                 f" - {interval.end.strftime('%I:%M%p')}"
+                 f" ({dur_in_hours:.1f}h)**\n")
+    else:
+        block = (f"{interval.begin.strftime('**%d %b, %I:%M%p')}"
+                 f" - {interval.end.strftime('%d %b, %I:%M%p')}"
+                 f" ({dur_in_hours:.1f}h)**\n")
+
+    return block + f"   ppl: {str(userids)}\n"
+
+
+def best_slots(overlap_dict, query):
+    """
+    Selects the query.k best common intervals, ranked by number of people, then by
+    duration, then by start. Uses a bounded heap, so only the selected intervals are
+    ever converted to Interval objects and formatted.
+    :param overlap_dict: result of find_all_common_intervals().
+    :param query: BestQuery.
+    :return: list of (Interval, set of userids), best first.
+    """
+    if isinstance(overlap_dict, compact.CompactOverlaps):
+        return overlap_dict.best(query.k, query.min_people,
+                                 query.min_dur // compact.MINUTE)
+    candidates = ((interval, ids) for interval, ids in overlap_dict.items()
+                  if len(ids) >= query.min_people
+                  and interval.end - interval.begin >= query.min_dur)
+    return heapq.nsmallest(query.k, candidates,
+                           key=lambda item: (-len(item[1]), item[0].begin - item[0].end,
+                                             item[0].begin))
+
+
+def format_best_slots(best, display_tz=None):
+    """
+    :param best: result of best_slots().
+    :param display_tz: see format_overlaps().
+    :return: string.
+    """
+    return format_header(BEST_HEADER, display_tz) + "\n".join(
+        format_block(interval, ids, display_tz) for interval, ids in best)
+
+
+def parse_best_query(s):
+    """
+    Parses a 'best K [min DURATION] [ppl N]' command, e.g. 'best 5 min 1h ppl 3'.
+    Whatever follows the command is returned as the schedule.
+    :param s: string.
+    :return: (BestQuery, rest of s).
+    """
+    match = BEST_REGEX.match(s)
+    if not match:
+        raise ValueError(BEST_FORMAT_MSG)
+    min_dur = ZERO_DUR
+    if match.group('min_dur'):
+        min_dur = parse_dur(match.group('min_dur'))
+        if not min_dur:
+            raise ValueError(BEST_FORMAT_MSG)
+    min_people = int(match.group('min_people') or 2)
+    query = BestQuery(int(match.group('k')), max(min_people, 2), min_dur)
+    return query, s[match.end():]
+
+
+def parse_free_query(s):
+    """
+    Parses a 'free DURATION [HH:MM-HH:MM] [ppl N]' command, e.g. 'free 1h 9:00-18:00'.
+    Whatever follows the command is returned as the schedule.
+    :param s: string.
+    :return: (FreeQuery, rest of s).
+    """
+    match = FREE_REGEX.match(s)
+    if not match:
+        raise ValueError(FREE_FORMAT_MSG)
+    duration = parse_dur(match.group('duration'))
+    if not duration:
+        raise ValueError(FREE_FORMAT_MSG)
+    day_begin = day_end = None
+    if match.group('day_begin'):
+        day_begin = parse_time_of_day(match.group('day_begin'))
+        day_end = parse_time_of_day(match.group('day_end'))
+        if day_begin is None or day_end is None:
+            raise ValueError(FREE_FORMAT_MSG)
+    min_people = match.group('min_people')
+    query = FreeQuery(duration, day_begin, day_end,
+                      max(int(min_people), 1) if min_people else None)
+    return query, s[match.end():]
+
+
+def parse_time_of_day(time_str):
+    """
+    :param time_str: 'HH:MM', 24h.
+    :return: timedelta since midnight, or None if time_str is not a time of day.
+    """
+    hour, minute = (int(part) for part in time_str.split(':'))
+    if hour > 24 or minute > 59 or (hour == 24 and minute):
+        return None
+    return timedelta(hours=hour, minutes=minute)
+
+
 def parse_dur(time_str):
-    regex = re.compile(r'((?P<hours>\d+?)h)?((?P<minutes>\d+?)m)?((?P<seconds>\d+?)s)?')
-    parts = regex.match(time_str)
+    parts = DUR_REGEX.match(time_str)
     if not parts:
         return
     parts = parts.groupdict()
@@ -224,31 +628,273 @@ def parse_dur(time_str):
     return timedelta(**time_params)
 
 
-def parse_dt_string(s):
+@lru_cache(maxsize=DT_CACHE_SIZE)
+def tokenize_dt(dt_str):
+    """
+    Hand-written grammar for the DATE/TIME formats in FORMAT_MSG and EXAMPLE_MSG, i.e.
+    '1 may 1:00pm', 'may 2 1:00pm', '2 may 13:00', '4:30pm' and '2 may'.
+    Results are cached since the same schedule tends to be pasted again and again.
+    :param dt_str: lowercase, stripped string.
+    :return: (month, day, hour, minute, second), where month and day are None if no
+    date was given, or None if dt_str is not in a format handled here.
+    """
+    match = DT_REGEX.match(dt_str)
+    if not match or (match.group('time') is None and match.group('date') is None):
+        return None
+
+    month = day = None
+    if match.group('date') is not None:
+        day = match.group('day_a') or match.group('day_b')
+        month = MONTHS[match.group('month_a') or match.group('month_b')]
+        day = int(day)
+
+    hour = minute = second = 0
+    if match.group('time') is not None:
+        hour = int(match.group('hour'))
+        minute = int(match.group('minute'))
+        second = int(match.group('second') or 0)
+        meridiem = match.group('meridiem')
+        if meridiem is not None:
+            if not 1 <= hour <= 12:
+                return None  # e.g. '13:00pm'. leave it to dateutil.
+            hour = hour % 12 + (12 if meridiem == 'pm' else 0)
+        if hour > 23 or minute > 59 or second > 59:
+            return None
+
+    return month, day, hour, minute, second
+
+
+def parse_dt(dt_str, today):
+    """
+    Parses a DATE TIME string. Missing date fields default to today, missing time
+    fields default to midnight, as with dateutil.parser.parse().
+    Falls back to dateutil for strings that tokenize_dt() does not handle.
+    :param dt_str: string.
+    :param today: datetime to take the default date from.
+    :return: datetime.
+    """
+    tokens = tokenize_dt(dt_str.strip().lower())
+    if tokens is not None:
+        month, day, hour, minute, second = tokens
+        if month is None:
+            month, day = today.month, today.day
+        try:
+            return dt(today.year, month, day, hour, minute, second)
+        except ValueError:
+            pass  # e.g. '31 apr'. let dateutil decide what to do with it.
+    dtp, parser_info = dateutil_parser()
+    return dtp.parse(dt_str, parserinfo=parser_info)
+
+
+@lru_cache(maxsize=None)
+def dateutil_parser():
+    """
+    Imports dateutil.parser on first use. Most strings are handled by tokenize_dt(), so
+    a process may never need it, and it is slow to import.
+    :return: (dateutil.parser module, its parserinfo for day-first dates).
+    """
+    # https://dateutil.readthedocs.io/en/stable/parser.html
+    import dateutil.parser as dtp
+    return dtp, dtp.parserinfo(dayfirst=True)
+
+
+def on_the_minute(d):
+    """
+    :return: True if datetime d has no seconds. Slots are minute-resolution.
+    """
+    return not (d.second or d.microsecond)
+
+
+def auto_set_year(start_dt, end_dt, today):
+    """
+    Sets the year of the interval. If the month has already passed this year, the
+    user is likely referring to next year.
+    :return: (start_dt, end_dt)
+    """
+    if today.month > start_dt.month:
+        year = today.year + 1
+    else:
+        year = today.year
+    return start_dt.replace(year=year), end_dt.replace(year=year)
+
+
+def general_timeslot(timeslot):
+    """
+    :param timeslot: one of GENERAL_TIMESLOTS.
+    :return: (start hour, duration timedelta).
+    """
+    try:
+        return GENERAL_TIMESLOTS[timeslot]
+    except KeyError:
+        raise ValueError(FORMAT_MSG)
+
+
+def parse_recurrence(interval_str, name, zone_name, today):
+    """
+    Parses a recurring slot, e.g. 'every tue 18:00-20:00 until 30 jun', 'weekdays lunch'
+    or 'daily 9:00am+1h'.
+    :param interval_str: string that matches RECURRENCE_REGEX.
+    :param name: whose slot it is.
+    :param zone_name: zone tag of name, or None.
+    :param today: datetime.
+    :return: Recurrence.
+    """
+    match = RECURRENCE_REGEX.match(interval_str)
+    days = match.group('days').lower().split()
+    if days[0] == 'every':
+        weekdays = WEEKDAYS[days[1]]
+    else:
+        weekdays = WEEKDAYS[days[0]]
+
+    slot = match.group('slot').strip().lower()
+    if slot in GENERAL_TIMESLOTS:
+        hour, dur = general_timeslot(slot)
+        minute = 0
+    elif slot.find('+') > 0:
+        start_str, dur_str = slot.split('+', 1)
+        start = parse_dt(start_str, today)
+        if not on_the_minute(start):
+            raise ValueError(RECURRENCE_FORMAT_MSG)
+        hour, minute = start.hour, start.minute
+        dur = parse_dur(dur_str.strip())
+    elif slot.find('-') > 0:
+        start_str, end_str = slot.split('-', 1)
+        start = parse_dt(start_str, today)
+        end = parse_dt(end_str, today)
+        if not (on_the_minute(start) and on_the_minute(end)):
+            raise ValueError(RECURRENCE_FORMAT_MSG)
+        hour, minute = start.hour, start.minute
+        dur = end - start
+        if dur <= ZERO_DUR:
+            dur += timedelta(days=1)  # end-time refers to next day.
+    else:
+        raise ValueError(RECURRENCE_FORMAT_MSG)
+    if not dur or dur % timedelta(minutes=1):
+        raise ValueError(RECURRENCE_FORMAT_MSG)
+
+    until = None
+    if match.group('until'):
+        until = parse_dt(match.group('until'), today)
+        if until.date() < today.date():
+            until = until.replace(year=today.year + 1)  # user likely referring to next year
+        until = until.date()
+    return Recurrence(name, zone_name, weekdays, hour, minute, dur, until)
+
+
+def recurrence_window(intervals, today, tzinfo=None, n_people=1):
+    """
+    The window recurring slots are expanded in. If only one person has recurring slots,
+    their occurrences can only overlap the slots that were given explicitly, so if there
+    are any, the window is their span. Otherwise recurring slots of different people can
+    overlap each other, so the window also covers the next RECURRENCE_HORIZON days.
+    :param intervals: the explicitly given Intervals of the message.
+    :param today: datetime.
+    :param tzinfo: tzinfo of the horizon. None for naive. Must match intervals.
+    :param n_people: number of people with recurring slots.
+    :return: (begin, end) datetimes. Aware if intervals are aware.
+    """
+    if intervals:
+        begin = min(interval.begin for interval in intervals)
+        end = max(interval.end for interval in intervals)
+        if n_people <= 1:
+            return begin, end
+    horizon_begin = today.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=tzinfo)
+    horizon_end = horizon_begin + RECURRENCE_HORIZON
+    if intervals:
+        return min(begin, horizon_begin), max(end, horizon_end)
+    return horizon_begin, horizon_end
+
+
+def iter_occurrences(recurrence, window_begin, window_end, zone_name=None):
+    """
+    Lazily yields the occurrences of recurrence that overlap the window, never any
+    outside it, and none after recurrence.until.
+    :param recurrence: Recurrence.
+    :param window_begin: datetime, aware if zone_name is given.
+    :param window_end: datetime, aware if zone_name is given.
+    :param zone_name: zone the recurrence's times are in. None for naive datetimes.
+    :return: generator of Intervals.
+    """
+    # local days to look at. one day of slack on either side covers zone offsets and
+    # occurrences that start the day before and run past midnight.
+    day = window_begin.date() - timedelta(days=1)
+    last_day = window_end.date() + timedelta(days=1)
+    if recurrence.until is not None:
+        last_day = min(last_day, recurrence.until)
+    while day <= last_day:
+        if day.weekday() in recurrence.weekdays:
+            start_dt = dt(day.year, day.month, day.day, recurrence.hour, recurrence.minute)
+            end_dt = start_dt + recurrence.duration
+            if zone_name is not None:
+                start_dt = tz.to_utc(start_dt, zone_name)
+                end_dt = tz.to_utc(end_dt, zone_name)
+            if start_dt < window_end and end_dt > window_begin:
+                yield Interval(start_dt, end_dt, recurrence.name)
+        day += timedelta(days=1)
+
+
+def split_dt_string(s):
+    """
+    Splits a formatted string into (name, zone, interval string) triples.
+    A name may be tagged with a time zone, e.g. 'Amy@Asia/Singapore'. '@' that is not
+    followed by a known zone is kept as part of the name, e.g. '@amy'.
+    :param s: string.
+    :returns: list of (name, zone_name or None, interval_str) tuples.
+    """
+    triples = []
+    groups = s.split('.')
+    for group in groups:
+        if group in ['']:
+            continue
+        k, v = group.split(':', 1)
+        name = k.strip()
+        zone_name = None
+        tagged_name, _, tag = name.rpartition('@')
+        if tagged_name and tz.get_zone(tag) is not None:
+            name, zone_name = tagged_name.strip(), tag
+        interval_strings = v.split(',')
+        for interval_str in interval_strings:
+            if interval_str in ['']:
+                continue
+            triples.append((name, zone_name, interval_str))
+    return triples
+
+
+def parse_dt_string(s, trace=NULL_TRACE, default_tz=None):
     """
     Parses a formatted string into a list of datetime interval objects.
 
     For TIME, the hour and min MUST be separated by ':', e.g. "15:00". not "15.00"
     See EXAMPLE for possible full formats.
 
+    Recurring slots, e.g. 'every tue 18:00-20:00 until 30 jun' or 'weekdays lunch', are
+    expanded only within recurrence_window().
+
+    If default_tz is given or any name is tagged with a zone (e.g. 'Amy@Asia/Singapore'),
+    all datetimes are converted to aware UTC datetimes. Slots of untagged names are then
+    read in default_tz, or in UTC if it is not given. Otherwise datetimes are naive.
+
     :param s: string.
+    :param trace: tracing.MessageTrace which records the split and parse stages.
+    :param default_tz: zone name, e.g. 'Asia/Singapore'.
     :returns: list of Intervals.
     """
     intervals = []
-    # https://dateutil.readthedocs.io/en/stable/parser.html
-    parser_info = dtp.parserinfo(dayfirst=True)
+    recurrences = []
+    today = dt.today()
+    with trace.stage('split'):
+        triples = split_dt_string(s)
+    if default_tz is not None and tz.get_zone(default_tz) is None:
+        raise ValueError(TZ_FORMAT_MSG)
+    aware = default_tz is not None or any(zone for _, zone, _ in triples)
     try:
-        groups = s.split('.')
-        for group in groups:
-            if group in ['']:
-                continue
-            k, v = group.split(':', 1)
-            name = k.strip()
-            interval_strings = v.split(',')
-            for interval_str in interval_strings:
-                if interval_str in ['']:
+        with trace.stage('parse'):
+            for name, zone_name, interval_str in triples:
+                if RECURRENCE_REGEX.match(interval_str):
+                    # expanded below, once the window is known.
+                    recurrences.append(parse_recurrence(interval_str, name, zone_name, today))
                     continue
-                if interval_str.find('+') > 0:
+                elif interval_str.find('+') > 0:
                     # '+' was found implying relative end-time was specified.
                     interval_parts = interval_str.split('+')
                     datetime_str = interval_parts[0].strip()
@@ -257,14 +903,8 @@ def parse_dt_string(s):
                     start_dt_str = datetime_str
                     if start_dt_str.find(':') < 0:
                         raise ValueError(FORMAT_MSG)
-                    start_dt = dtp.parse(start_dt_str, parserinfo=parser_info)
-
-                    # auto set year
-                    if dt.today().month > start_dt.month:
-                        # user likely referring to next year
-                        start_dt = start_dt.replace(year=dt.today().year+1)
-                    else:
-                        start_dt = start_dt.replace(year=dt.today().year)
+                    start_dt = parse_dt(start_dt_str, today)
+                    start_dt, _ = auto_set_year(start_dt, start_dt, today)
                     end_dt = start_dt + dur
                 elif interval_str.find('-') > 0:
                     # '-' was found implying absolute end-time was specified.
@@ -272,19 +912,19 @@ def parse_dt_string(s):
                     start_dt_str = interval_parts[0].strip()
                     if start_dt_str.find(':') < 0:
                         raise ValueError(FORMAT_MSG)
-                    start_dt = dtp.parse(start_dt_str, parserinfo=parser_info)
+                    start_dt = parse_dt(start_dt_str, today)
 
                     # determine is interval's end was specified as datetime or time.
                     end_str = interval_parts[1].strip()
                     if end_str.find(' ') > 0:
                         # date was specified. e.g. '2 feb 13:00'
                         end_dt_str = end_str
-                        end_dt = dtp.parse(end_dt_str, parserinfo=parser_info)
+                        end_dt = parse_dt(end_dt_str, today)
                     else:
                         # only time was specified.
                         if end_str.find(':') < 0:
                             raise ValueError(FORMAT_MSG)
-                        tmp_dt = dtp.parse(end_str, parserinfo=parser_info)  # for time.
+                        tmp_dt = parse_dt(end_str, today)  # for time.
                         end_dt = start_dt  # for base dt info, which will be replaced.
                         if tmp_dt.hour < start_dt.hour:
                             # end-time refers to next day.
@@ -292,67 +932,177 @@ def parse_dt_string(s):
                         else:
                             end_dt = end_dt.replace(hour=tmp_dt.hour, minute=tmp_dt.minute)
 
-                    # auto set year
-                    if dt.today().month > start_dt.month:
-                        # user likely referring to next year
-                        start_dt = start_dt.replace(year=dt.today().year + 1)
-                        end_dt = end_dt.replace(year=dt.today().year + 1)
-                    else:
-                        start_dt = start_dt.replace(year=dt.today().year)
-                        end_dt = end_dt.replace(year=dt.today().year)
+                    start_dt, end_dt = auto_set_year(start_dt, end_dt, today)
                 else:
                     interval_parts = interval_str.split()
                     timeslot = interval_parts[-1].strip().lower()
                     start_dt_str = interval_parts[0] + ' ' + interval_parts[1]
-                    start_dt = dtp.parse(start_dt_str, parserinfo=parser_info)
-                    start_dt = start_dt.replace(year=dt.today().year)
-                    if timeslot not in GENERAL_TIMESLOTS:
-                        raise ValueError(FORMAT_MSG)
-                    elif timeslot == 'breakfast':
-                        start_dt = start_dt.replace(hour=8)
-                        delta = timedelta(hours=2,minutes=30)
-                    elif timeslot == 'brunch':
-                        start_dt = start_dt.replace(hour=11)
-                        delta = timedelta(hours=2,minutes=30)
-                    elif timeslot == 'lunch':
-                        start_dt = start_dt.replace(hour=12)
-                        delta = timedelta(hours=2,minutes=30)
-                    elif timeslot == 'dinner':
-                        start_dt = start_dt.replace(hour=18)
-                        delta = timedelta(hours=2,minutes=30)
-                    elif timeslot == 'supper':
-                        start_dt = start_dt.replace(hour=21)
-                        delta = timedelta(hours=2,minutes=30)
-                    elif timeslot == 'morning':
-                        start_dt = start_dt.replace(hour=8)
-                        delta = timedelta(hours=4)
-                    elif timeslot == 'afternoon':
-                        start_dt = start_dt.replace(hour=12)
-                        delta = timedelta(hours=6)
-                    elif timeslot == 'night':
-                        start_dt = start_dt.replace(hour=19)
-                        delta = timedelta(hours=5)
+                    start_dt = parse_dt(start_dt_str, today)
+                    start_dt = start_dt.replace(year=today.year)
+                    hour, delta = general_timeslot(timeslot)
+                    start_dt = start_dt.replace(hour=hour)
                     end_dt = start_dt + delta
 
-                    # auto set year
-                    if dt.today().month > start_dt.month:
-                        # user likely referring to next year
-                        start_dt = start_dt.replace(year=dt.today().year + 1)
-                        end_dt = end_dt.replace(year=dt.today().year + 1)
-                    else:
-                        start_dt = start_dt.replace(year=dt.today().year)
-                        end_dt = end_dt.replace(year=dt.today().year)
+                    start_dt, end_dt = auto_set_year(start_dt, end_dt, today)
+
+                if not (on_the_minute(start_dt) and on_the_minute(end_dt)):
+                    # the sweep engine works in whole minutes, see compact.to_minutes().
+                    raise ValueError(FORMAT_MSG)
+
+                if aware:
+                    zone_name = zone_name or default_tz or 'UTC'
+                    start_dt = tz.to_utc(start_dt, zone_name)
+                    end_dt = tz.to_utc(end_dt, zone_name)
 
                 interval = Interval(start_dt, end_dt, name)
-                print(interval)  # debugging statement
-                print()
+                trace.log("parsed %s", interval)
                 intervals.append(interval)
+
+            if recurrences:
+                n_people = len({recurrence.name for recurrence in recurrences})
+                window_begin, window_end = recurrence_window(intervals, today,
+                                                             tz.UTC if aware else None,
+                                                             n_people)
+                for recurrence in recurrences:
+                    zone_name = (recurrence.zone or default_tz or 'UTC') if aware else None
+                    intervals.extend(iter_occurrences(recurrence, window_begin, window_end,
+                                                      zone_name))
     except IndexError:
         raise IndexError(FORMAT_MSG)
 
     return intervals
 
 
+def schedule_key(dt_list, engine=DEFAULT_ENGINE, today=None):
+    """
+    Canonical key of a parsed schedule, which is the same however the schedule was
+    written (order of people and slots, 12h vs 24h, relative vs absolute end-times).
+    The current year is part of the key, since it decides which year dates without a
+    year refer to.
+    :param dt_list: list of Intervals.
+    :param engine: see find_all_common_intervals().
+    :param today: datetime, defaults to dt.today().
+    :return: hex digest string.
+    """
+    today = today or dt.today()
+    canonical = sorted((interval.data, interval.begin.isoformat(), interval.end.isoformat())
+                       for interval in dt_list)
+    return sha1(repr((today.year, engine, canonical)).encode()).hexdigest()
+
+
+def compute_intervals(s, engine=DEFAULT_ENGINE, trace=NULL_TRACE, default_tz=None):
+    """
+    Parses s and computes its schedule_key(). This is the first half of handling a
+    message, and is what the bot runs in its worker pool.
+    :param s: string in the format of FORMAT_MSG.
+    :param engine: see find_all_common_intervals().
+    :param trace: tracing.MessageTrace.
+    :param default_tz: see parse_dt_string().
+    :return: (list of Intervals, key, trace). The trace is returned so that timings
+    recorded in a worker process make it back to the caller.
+    """
+    dt_list = parse_dt_string(s, trace, default_tz)
+    trace.count('intervals', len(dt_list))
+    with trace.stage('key'):
+        key = schedule_key(dt_list, engine)
+    return dt_list, key, trace
+
+
+def compute_reply(dt_list, engine=DEFAULT_ENGINE, trace=NULL_TRACE, query=None,
+                  max_chars=PAGE_CHARS, min_people=2, display_tz=None):
+    """
+    Finds all common intervals and formats them. This is the second half of handling a
+    message, which the bot skips if the reply is already cached.
+    :param dt_list: list of Intervals.
+    :param engine: see find_all_common_intervals().
+    :param trace: tracing.MessageTrace.
+    :param query: BestQuery, to format only the best common intervals, or FreeQuery, to
+    find free windows with find_free_windows() instead.
+    :param max_chars: maximum length of a page.
+    :param min_people: quorum, see find_all_common_intervals().
+    :param display_tz: see format_overlaps().
+    :return: (list of pages, trace). See format_reply().
+    """
+    if display_tz is None and dt_list and dt_list[0].begin.tzinfo is not None:
+        display_tz = 'UTC'  # so that it is clear which zone the times are in.
+    if isinstance(query, FreeQuery):
+        with trace.stage('free'):
+            free_dict = find_free_windows(dt_list, query.duration,
+                                          day_begin=query.day_begin, day_end=query.day_end,
+                                          min_people=query.min_people, zone_name=display_tz)
+        trace.count('overlaps', len(free_dict))
+        return format_reply(free_dict, trace, None, max_chars, display_tz, FREE_HEADER)
+    if query is not None:
+        min_people = max(min_people, query.min_people)
+    overlap_dict, trace = solve_intervals(dt_list, engine, trace, min_people)
+    return format_reply(overlap_dict, trace, query, max_chars, display_tz)
+
+
+def solve_intervals(dt_list, engine=DEFAULT_ENGINE, trace=NULL_TRACE, min_people=2):
+    """
+    Overlap stage shared by the bot (through compute_reply()) and by batch.py.
+    :param dt_list: list of Intervals, e.g. from compute_intervals().
+    :param engine: see find_all_common_intervals().
+    :param trace: tracing.MessageTrace.
+    :param min_people: quorum, see find_all_common_intervals().
+    :return: (result of find_all_common_intervals(), trace).
+    """
+    with trace.stage('overlap'):
+        overlap_dict = find_all_common_intervals(dt_list, engine=engine,
+                                                 min_people=min_people)
+    trace.count('overlaps', len(overlap_dict))
+    return overlap_dict, trace
+
+
+def format_reply(overlap_dict, trace=NULL_TRACE, query=None, max_chars=PAGE_CHARS,
+                 display_tz=None, header=OVERLAPS_HEADER):
+    """
+    :param overlap_dict: result of find_all_common_intervals().
+    :param trace: tracing.MessageTrace.
+    :param query: BestQuery, to format only the best common intervals.
+    :param max_chars: maximum length of a page.
+    :param display_tz: see format_overlaps().
+    :param header: header of the first page, unless query is given.
+    :return: (list of pages, trace). Each page is a string of at most max_chars
+    characters, unless a single block is longer than that.
+    """
+    with trace.stage('format'):
+        if query is None:
+            pages = list(paginate(iter_overlap_blocks(overlap_dict, display_tz),
+                                  format_header(header, display_tz), max_chars))
+        else:
+            best = best_slots(overlap_dict, query)
+            pages = list(paginate((format_block(interval, ids, display_tz)
+                                   for interval, ids in best),
+                                  format_header(BEST_HEADER, display_tz), max_chars))
+    return pages, trace
+
+
+def parse_quorum_query(s):
+    """
+    Parses a 'quorum N' command. Whatever follows the command is returned as the
+    schedule.
+    :param s: string.
+    :return: (N, rest of s).
+    """
+    match = QUORUM_REGEX.match(s)
+    if not match:
+        raise ValueError(QUORUM_FORMAT_MSG)
+    return max(int(match.group('min_people')), 2), s[match.end():]
+
+
+def parse_tz_query(s):
+    """
+    Parses a 'tz ZONE' prefix. Whatever follows it is returned as the rest of the message.
+    :param s: string.
+    :return: (zone name, rest of s).
+    """
+    match = TZ_REGEX.match(s)
+    if not match or tz.get_zone(match.group('zone')) is None:
+        raise ValueError(TZ_FORMAT_MSG)
+    return match.group('zone'), s[match.end():]
+
+
 def help_msg():
     return HELP_MSG + FORMAT_MSG
 
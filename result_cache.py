@@ -0,0 +1,73 @@
+import sys
+from collections import OrderedDict
+from time import monotonic
+
+
+class ResultCache:
+    """
+    LRU cache with a time-to-live and a memory bound, for formatted replies.
+    Entries are evicted least-recently-used first once either max_entries or max_bytes
+    is exceeded. Expired entries are dropped when they are looked up.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, ttl=3600.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()  # key: cache key, value: (expiry, nbytes, value).
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.RESULT_CACHE_ENTRIES, config.RESULT_CACHE_BYTES,
+                   config.RESULT_CACHE_TTL)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        :return: the cached value, or None on a miss.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < monotonic():
+            self._evict(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, key, value):
+        nbytes = sys.getsizeof(key) + _sizeof(value)
+        if nbytes > self.max_bytes:
+            return  # would evict everything else and still not fit.
+        if key in self._entries:
+            self._evict(key)
+        self._entries[key] = (monotonic() + self.ttl, nbytes, value)
+        self.nbytes += nbytes
+        while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, key):
+        _, nbytes, _ = self._entries.pop(key)
+        self.nbytes -= nbytes
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries),
+                'bytes': self.nbytes}
+
+
+def _sizeof(value):
+    """
+    :return: bytes of value, including the strings inside it if it is a tuple or list
+    (e.g. reply pages). sys.getsizeof() alone only counts the references.
+    """
+    nbytes = sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        nbytes += sum(sys.getsizeof(item) for item in value)
+    return nbytes
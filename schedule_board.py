@@ -0,0 +1,132 @@
+from bisect import bisect_left
+
+from intervaltree import Interval
+
+
+class ScheduleBoard:
+    """
+    A conversation's schedule, built up one person at a time.
+
+    Besides each person's slots, the board keeps the timeline cut at every slot begin
+    and end into elementary segments, each labelled with how many slots of each person
+    cover it. Adding or removing one slot only touches the segments it covers, so
+    updating one person costs time proportional to that person's slots rather than to
+    the size of the group.
+    """
+
+    def __init__(self):
+        self.slots = dict()  # key: name, value: list of (begin, end).
+        self.times = []  # sorted segment boundaries.
+        self.counts = []  # counts[i] is {name: n} for the segment times[i]..times[i+1].
+
+    def __len__(self):
+        return len(self.slots)
+
+    def set_person(self, name, intervals):
+        """
+        Replaces all of name's slots.
+        :param name: string.
+        :param intervals: list of Interval or (begin, end) tuples.
+        """
+        self.remove_person(name)
+        slots = [(interval[0], interval[1]) for interval in intervals
+                 if interval[0] < interval[1]]
+        for begin, end in slots:
+            self._add(name, begin, end, 1)
+        if slots:
+            self.slots[name] = slots
+
+    def remove_person(self, name):
+        """
+        Removes all of name's slots. Does nothing if name has no slots.
+        """
+        for begin, end in self.slots.pop(name, []):
+            self._add(name, begin, end, -1)
+
+    def clear(self):
+        self.__init__()
+
+    def intervals(self):
+        """
+        :return: list of Interval(begin, end, name) of everyone's slots, like
+        overlap_finder.parse_dt_string().
+        """
+        return [Interval(begin, end, name) for name, slots in self.slots.items()
+                for begin, end in slots]
+
+    def overlaps(self, min_people=2):
+        """
+        :param min_people: quorum. only common intervals shared by at least this many
+        people are returned.
+        :return: a dict (key: Interval, value: set of names which share that interval),
+        like overlap_finder.find_all_common_intervals().
+        """
+        overlap_dict = dict()
+        seg_begin = None
+        seg_ids = None
+        min_people = max(min_people, 2)
+        for i, count in enumerate(self.counts):
+            current = frozenset(count) if len(count) >= min_people else None
+            if current != seg_ids:
+                if seg_ids is not None:
+                    overlap_dict[Interval(seg_begin, self.times[i])] = set(seg_ids)
+                seg_begin, seg_ids = self.times[i], current
+        if seg_ids is not None:
+            overlap_dict[Interval(seg_begin, self.times[-1])] = set(seg_ids)
+        return overlap_dict
+
+    def _add(self, name, begin, end, delta):
+        first = self._split(begin)
+        last = self._split(end)
+        for count in self.counts[first:last]:
+            n = count.get(name, 0) + delta
+            if n:
+                count[name] = n
+            else:
+                del count[name]
+        # boundaries inside first..last still separate different counts, since both
+        # sides changed alike. last first, so that first's index stays valid.
+        self._merge(last)
+        self._merge(first)
+        self._trim()
+
+    def _split(self, time):
+        """
+        Makes time a segment boundary. The new segments inherit the counts of the segment
+        that was split.
+        :return: index of time in self.times.
+        """
+        idx = bisect_left(self.times, time)
+        if idx < len(self.times) and self.times[idx] == time:
+            return idx
+        if self.times:
+            if idx == 0:
+                self.counts.insert(0, dict())
+            elif idx == len(self.times):
+                self.counts.append(dict())
+            else:
+                self.counts.insert(idx, dict(self.counts[idx - 1]))
+        self.times.insert(idx, time)
+        return idx
+
+    def _merge(self, idx):
+        """
+        Removes the boundary at index idx if the segments on both sides have the same
+        counts, so that the board only grows with the current slots, not with the edits.
+        """
+        if 0 < idx < len(self.counts) and self.counts[idx - 1] == self.counts[idx]:
+            del self.times[idx]
+            del self.counts[idx]
+
+    def _trim(self):
+        """
+        Removes segments that no one covers from both ends of the timeline.
+        """
+        while self.counts and not self.counts[0]:
+            del self.times[0]
+            del self.counts[0]
+        while self.counts and not self.counts[-1]:
+            del self.times[-1]
+            del self.counts[-1]
+        if not self.counts:
+            self.times.clear()
@@ -0,0 +1,172 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+
+import jsonpickle
+from botbuilder.core import MemoryStorage, Storage, StoreItem
+
+MEMORY_STORAGE = "memory"
+SQLITE_STORAGE = "sqlite"
+
+_ABSENT = object()  # cached marker for keys that are known not to be stored.
+
+
+class SqliteStorage(Storage):
+    """
+    Bot state in a local SQLite file, with a write-behind cache in front of it.
+
+    Nothing is loaded at startup: a key is read from the file the first time it is
+    asked for, and kept in the cache after that. Writes go to the cache and are
+    flushed to the file in batches, at most flush_interval seconds later or as soon as
+    batch_size keys are waiting, whichever comes first. A key written several times
+    before a flush is only written to the file once. Values are kept as jsonpickle
+    strings, so reads hand out copies and the cache's size is easy to bound.
+
+    Like MemoryStorage, the last write wins; e_tags are stored but not checked.
+    Writes that were not flushed yet are lost if the process dies, so call close()
+    on shutdown.
+    """
+
+    def __init__(self, path, flush_interval=1.0, batch_size=100, max_entries=10000):
+        """
+        :param path: SQLite database file. created if missing.
+        :param flush_interval: seconds a write may wait in the cache before it is
+        flushed.
+        :param batch_size: waiting writes that trigger a flush right away.
+        :param max_entries: keys kept in the cache. only keys that were flushed are
+        evicted.
+        """
+        super().__init__()
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_entries = max_entries
+        self._cache = OrderedDict()  # key: storage key, value: json string or _ABSENT.
+        self._dirty = set()  # keys whose cached value is not in the file yet.
+        self._flushing = set()  # keys being written by flush(), not in the file yet.
+        self._lock = asyncio.Lock()
+        self._timer = None
+        self._db_lock = threading.Lock()
+        # imported here, so that the default memory storage does not load sqlite3.
+        import sqlite3
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS state "
+                           "(key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.STORAGE_PATH, config.STORAGE_FLUSH_INTERVAL,
+                   config.STORAGE_BATCH_SIZE, config.STORAGE_CACHE_ENTRIES)
+
+    async def read(self, keys: List[str]):
+        data = {}
+        if not keys:
+            return data
+        missing = [key for key in keys if key not in self._cache]
+        if missing:
+            rows = await self._run(self._select, missing)
+            for key in missing:
+                # a write that came in while the file was read is newer, keep it.
+                self._cache.setdefault(key, rows.get(key, _ABSENT))
+        for key in keys:
+            value = self._cache[key]
+            self._cache.move_to_end(key)
+            if value is not _ABSENT:
+                data[key] = jsonpickle.decode(value)
+        self._evict()
+        return data
+
+    async def write(self, changes: Dict[str, StoreItem]):
+        if changes is None:
+            raise Exception("Changes are required when writing")
+        for key, change in changes.items():
+            self._cache[key] = jsonpickle.encode(change)
+            self._cache.move_to_end(key)
+            self._dirty.add(key)
+        await self._schedule_flush()
+
+    async def delete(self, keys: List[str]):
+        for key in keys:
+            self._cache[key] = _ABSENT
+            self._dirty.add(key)
+        await self._schedule_flush()
+
+    async def flush(self):
+        """
+        Writes all waiting changes to the file in one transaction.
+        """
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return
+            batch = {key: self._cache.get(key, _ABSENT) for key in self._dirty}
+            self._dirty.clear()
+            # keys written again during the commit go back into _dirty for the next one.
+            self._flushing = set(batch)
+            try:
+                await self._run(self._commit, batch)
+            except Exception:
+                self._dirty.update(batch)
+                raise
+            finally:
+                self._flushing = set()
+            self._evict()
+
+    async def close(self):
+        await self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+    async def _schedule_flush(self):
+        if len(self._dirty) >= self.batch_size:
+            await self.flush()
+        elif self._dirty and self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.flush_interval,
+                                          lambda: loop.create_task(self.flush()))
+
+    def _evict(self):
+        # dirty keys must stay until their flush has committed, or a read would fetch
+        # the old row. so the cache may run over max_entries by the keys waiting.
+        excess = len(self._cache) - self.max_entries
+        for key in list(self._cache):
+            if excess <= 0:
+                break
+            if key not in self._dirty and key not in self._flushing:
+                del self._cache[key]
+                excess -= 1
+
+    async def _run(self, func, *args):
+        # sqlite3 calls block, so they run on the default executor, off the event loop.
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def _select(self, keys):
+        placeholders = ",".join("?" * len(keys))
+        with self._db_lock:
+            return dict(self._conn.execute(
+                f"SELECT key, value FROM state WHERE key IN ({placeholders})", keys))
+
+    def _commit(self, batch):
+        with self._db_lock, self._conn:
+            self._conn.executemany("DELETE FROM state WHERE key = ?",
+                                   [(key,) for key, value in batch.items()
+                                    if value is _ABSENT])
+            self._conn.executemany("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                                   [(key, value) for key, value in batch.items()
+                                    if value is not _ABSENT])
+
+
+def create_storage(config):
+    """
+    :return: the Storage named by config.STORAGE, 'memory' (default) or 'sqlite'.
+    """
+    if config.STORAGE == MEMORY_STORAGE:
+        return MemoryStorage()
+    if config.STORAGE == SQLITE_STORAGE:
+        return SqliteStorage.from_config(config)
+    raise ValueError(f"Unknown storage {config.STORAGE!r}, expected "
+                     f"{MEMORY_STORAGE!r} or {SQLITE_STORAGE!r}")
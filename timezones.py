@@ -0,0 +1,76 @@
+"""
+Cached time zone lookups and UTC conversions.
+
+Zones are resolved once per name, and UTC offsets are cached per (zone, wall time), so
+converting hundreds of slots that fall on the same few times does not repeatedly walk a
+zone's DST transition table.
+"""
+from datetime import timezone
+from functools import lru_cache
+
+UTC = timezone.utc
+
+# number of zone names remembered, including names that are not zones.
+ZONE_CACHE_SIZE = 1024
+
+# number of distinct (zone, time) offsets remembered.
+OFFSET_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=ZONE_CACHE_SIZE)
+def get_zone(name):
+    """
+    :param name: IANA zone name, e.g. 'Asia/Singapore', or 'UTC'.
+    :return: tzinfo, or None if there is no such zone.
+    """
+    if name.upper() == 'UTC':
+        return UTC
+    # imported here, schedules without zone tags never need it.
+    try:
+        from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+    except ImportError:  # python < 3.9
+        from dateutil import tz as dateutil_tz
+        return dateutil_tz.gettz(name)
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=OFFSET_CACHE_SIZE)
+def local_utc_offset(zone_name, local):
+    """
+    :param zone_name: see get_zone().
+    :param local: naive datetime, wall time in the zone.
+    :return: timedelta, UTC offset of the zone at that wall time.
+    """
+    return local.replace(tzinfo=get_zone(zone_name)).utcoffset()
+
+
+@lru_cache(maxsize=OFFSET_CACHE_SIZE)
+def utc_to_local_offset(zone_name, utc):
+    """
+    :param zone_name: see get_zone().
+    :param utc: naive datetime, in UTC.
+    :return: timedelta, UTC offset of the zone at that instant.
+    """
+    return utc.replace(tzinfo=UTC).astimezone(get_zone(zone_name)).utcoffset()
+
+
+def to_utc(local, zone_name):
+    """
+    :param local: naive datetime, wall time in the zone.
+    :param zone_name: see get_zone().
+    :return: aware datetime in UTC.
+    """
+    return (local - local_utc_offset(zone_name, local)).replace(tzinfo=UTC)
+
+
+def to_local(d, zone_name):
+    """
+    :param d: aware datetime.
+    :param zone_name: see get_zone().
+    :return: aware datetime in the zone.
+    """
+    utc = d.astimezone(UTC).replace(tzinfo=None)
+    return (utc + utc_to_local_offset(zone_name, utc)).replace(tzinfo=get_zone(zone_name))
@@ -0,0 +1,85 @@
+import logging
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+LOGGER = logging.getLogger('eventboybot.trace')
+
+
+class MessageTrace:
+    """
+    Collects per-stage timings (e.g. split, parse, overlap, format) and counts (e.g.
+    intervals, overlaps) for one message, and debug events that are logged lazily to
+    LOGGER.
+    """
+    enabled = True
+
+    def __init__(self, label=''):
+        self.label = label
+        self.timings = {}  # key: stage name, value: seconds spent in that stage.
+        self.counts = {}  # key: what was counted, value: how many.
+
+    @contextmanager
+    def stage(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + perf_counter() - start
+
+    def count(self, name, n):
+        self.counts[name] = n
+
+    def log(self, msg, *args):
+        LOGGER.debug(msg, *args)
+
+    def emit(self):
+        LOGGER.debug("%s timings: %s counts: %s", self.label, _Timings(self.timings),
+                     self.counts)
+
+
+class NullTrace:
+    """
+    Stand-in for MessageTrace when tracing is disabled. Every method is a no-op.
+    """
+    enabled = False
+    label = ''
+    timings = {}
+    counts = {}
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def count(self, name, n):
+        pass
+
+    def log(self, msg, *args):
+        pass
+
+    def emit(self):
+        pass
+
+
+NULL_TRACE = NullTrace()
+_NULL_STAGE = nullcontext()
+
+
+class _Timings:
+    """ Formats timings only if the log record is actually emitted. """
+
+    def __init__(self, timings):
+        self.timings = timings
+
+    def __str__(self):
+        return ", ".join(f"{name}={secs * 1000:.2f}ms" for name, secs in self.timings.items())
+
+
+def start_trace(label='', force=False):
+    """
+    :param label: identifies the message in the log, e.g. the conversation id.
+    :param force: return a MessageTrace even if LOGGER is disabled, e.g. because the
+    timings are needed for metrics.
+    :return: a MessageTrace if LOGGER has DEBUG enabled, else NULL_TRACE.
+    """
+    if force or LOGGER.isEnabledFor(logging.DEBUG):
+        return MessageTrace(label)
+    return NULL_TRACE
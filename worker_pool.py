@@ -0,0 +1,124 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+PROCESS_POOL = 'process'
+THREAD_POOL = 'thread'
+
+
+class PoolBusyError(Exception):
+    """ Raised when the pool already has its maximum number of pending jobs. """
+
+
+class PoolTimeoutError(Exception):
+    """ Raised when a job does not finish within the pool's timeout. """
+
+
+class WorkerPool:
+    """
+    Runs CPU-bound jobs (parsing, overlap search, formatting) off the aiohttp event loop,
+    so one large schedule does not stall every other conversation.
+
+    At most size + queue_size jobs are pending at any time. A job holds its slot until it
+    has actually finished in the worker, even if the caller already gave up waiting.
+    """
+
+    def __init__(self, kind=PROCESS_POOL, size=1, queue_size=0, timeout=None):
+        if kind not in (PROCESS_POOL, THREAD_POOL):
+            raise ValueError(f"unknown worker pool: {kind}")
+        self.kind = kind
+        self.size = size
+        self.max_pending = size + queue_size
+        self.timeout = timeout
+        self.pending = 0
+        self._executor = None  # created on first use.
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.WORKER_POOL, config.WORKER_POOL_SIZE,
+                   config.WORKER_QUEUE_SIZE, config.WORKER_TIMEOUT)
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.kind == PROCESS_POOL:
+                self._executor = ProcessPoolExecutor(max_workers=self.size)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.size)
+        return self._executor
+
+    async def run(self, func, *args, deadline=None):
+        """
+        Runs func(*args) in the pool. For a process pool, func and args must be picklable.
+        If a worker process died, the pool is replaced and the job is turned away as busy.
+        :param deadline: event loop time by which func must return, e.g. from deadline(),
+        to share one timeout between several jobs. Defaults to the pool's timeout from now.
+        :raises PoolBusyError: if the pool is full or broken.
+        :raises PoolTimeoutError: if func does not return within the timeout.
+        :return: return value of func.
+        """
+        loop = asyncio.get_running_loop()
+        timeout = self.timeout if deadline is None else deadline - loop.time()
+        if timeout is not None and timeout <= 0:
+            raise PoolTimeoutError()
+        if self.pending >= self.max_pending:
+            raise PoolBusyError()
+        self.pending += 1
+        executor = self.executor
+        try:
+            future = loop.run_in_executor(executor, func, *args)
+        except BrokenProcessPool as e:
+            self.pending -= 1
+            self._reset(executor)
+            raise PoolBusyError() from e
+        except Exception:
+            self.pending -= 1
+            raise
+        future.add_done_callback(self._release)
+        try:
+            # shield, so that a timeout does not release the slot while the job still runs.
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeoutError()
+        except BrokenProcessPool as e:
+            # a worker died while running this or another job.
+            self._reset(executor)
+            raise PoolBusyError() from e
+
+    def deadline(self):
+        """
+        :return: event loop time at which a message started now runs out of time, or
+        None if the pool has no timeout. See run().
+        """
+        if self.timeout is None:
+            return None
+        return asyncio.get_running_loop().time() + self.timeout
+
+    async def warm_up(self):
+        """
+        Starts the workers before the first message needs them, so that it does not
+        wait for processes to start and import the overlap finder.
+        """
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, _warm_up)
+                               for _ in range(self.size)))
+
+    def _reset(self, executor):
+        # the next job builds a new pool. jobs still waiting on the broken one fail.
+        if self._executor is executor:
+            self._executor = None
+            executor.shutdown(wait=False)
+
+    def _release(self, future):
+        self.pending -= 1
+        if not future.cancelled():
+            future.exception()  # mark as retrieved, in case the caller timed out.
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def _warm_up():
+    import overlap_finder  # already imported if the workers were forked.